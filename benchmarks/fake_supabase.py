@@ -0,0 +1,403 @@
+"""Cliente Supabase falso, em memória, com latência configurável por requisição.
+
+Implementa só a cadeia usada pelo importador:
+table().select/insert/update/upsert/delete().eq/in_/or_/limit().execute()
+e rpc('import_jobs_batch', ...).execute()
+"""
+import copy
+import re
+import threading
+import time
+
+from postgrest.exceptions import APIError
+
+PRIMARY_KEYS = {
+    'jobs': 'id',
+    'company': 'id',
+    'title_taxonomy': 'id',
+    'skill_2_skill_pt_br': 'id',
+}
+
+# (tabela, coluna, tabela referenciada), como em database.md
+FOREIGN_KEYS = [
+    ('jobs', 'company', 'company'),
+    ('jobs', 'title', 'title_taxonomy'),
+    ('job_skill', 'job', 'jobs'),
+    ('job_skill', 'skill', 'skill_2_skill_pt_br'),
+]
+
+# Colunas character varying(n) com limite, como em database.md
+VARCHAR_LIMITS = {
+    'jobs': {'id': 40, 'language': 2},
+}
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+def _split_top_level(text):
+    """Divide por vírgulas que não estão dentro de parênteses ou aspas"""
+    parts, depth, quoted, current = [], 0, False, []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if quoted and char == '\\':
+            current.append(text[i:i + 2])
+            i += 2
+            continue
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and char == ',':
+            parts.append(''.join(current))
+            current = []
+            i += 1
+            continue
+        current.append(char)
+        i += 1
+    parts.append(''.join(current))
+    return parts
+
+def _unquote(value):
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        return re.sub(r'\\(.)', r'\1', value[1:-1])
+    return value
+
+def _parse_condition(text):
+    """Converte um filtro lógico do PostgREST (and/or/eq/in/is) numa função sobre a linha.
+
+    Retorna (função, dica), onde a dica é (coluna, valores) quando toda linha
+    que satisfaz o filtro tem a coluna num desses valores; serve para usar índice.
+    """
+    match = re.match(r'^(and|or)\((.*)\)$', text, re.S)
+    if match:
+        parsed = [_parse_condition(part) for part in _split_top_level(match.group(2))]
+        children = [condition for condition, _ in parsed]
+        hints = [hint for _, hint in parsed]
+        if match.group(1) == 'and':
+            hint = next((hint for hint in hints if hint), None)
+            return (lambda row: all(child(row) for child in children)), hint
+        columns = {hint[0] for hint in hints if hint}
+        hint = None
+        if all(hints) and len(columns) == 1:
+            hint = (columns.pop(), set().union(*(hint[1] for hint in hints)))
+        return (lambda row: any(child(row) for child in children)), hint
+    column, operator, value = text.split('.', 2)
+    if operator == 'eq':
+        expected = _unquote(value)
+        return (lambda row: row.get(column) is not None and str(row.get(column)) == expected), (column, {expected})
+    if operator == 'in':
+        values = {_unquote(part) for part in _split_top_level(value[1:-1])}
+        return (lambda row: row.get(column) is not None and str(row.get(column)) in values), (column, values)
+    if operator == 'is' and value == 'null':
+        return (lambda row: row.get(column) is None), None
+    raise ValueError(f"Filtro não suportado pelo cliente falso: {text}")
+
+class FakeQuery:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.operation = 'select'
+        self.columns = '*'
+        self.payload = None
+        self.filters = []
+        self.hints = []
+        self.count = None
+        self.on_conflict = None
+        self.ignore_duplicates = False
+        self.row_limit = None
+
+    # Operações
+    def select(self, *columns, count=None, **kwargs):
+        self.operation = 'select'
+        self.columns = ','.join(columns) or '*'
+        self.count = count
+        return self
+
+    def insert(self, payload, **kwargs):
+        self.operation, self.payload = 'insert', payload
+        return self
+
+    def upsert(self, payload, on_conflict='', ignore_duplicates=False, **kwargs):
+        self.operation, self.payload = 'upsert', payload
+        self.on_conflict = on_conflict or PRIMARY_KEYS.get(self.table, 'id')
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, payload, **kwargs):
+        self.operation, self.payload = 'update', payload
+        return self
+
+    def delete(self, **kwargs):
+        self.operation = 'delete'
+        return self
+
+    # Filtros
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        self.hints.append((column, {value}))
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        self.hints.append((column, values))
+        return self
+
+    def or_(self, condition):
+        condition, hint = _parse_condition(f"or({condition})")
+        self.filters.append(condition)
+        if hint:
+            self.hints.append(hint)
+        return self
+
+    def limit(self, size):
+        self.row_limit = size
+        return self
+
+    def execute(self):
+        return self.client._execute(self)
+
+class FakeRpc:
+    def __init__(self, client, name, params):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        return self.client._execute_rpc(self)
+
+def _api_error(code, message, details=None):
+    return APIError({"code": code, "message": message, "details": details, "hint": None})
+
+class FakeSupabase:
+    """Banco em memória que imita as respostas e os erros do PostgREST.
+
+    `latency` (segundos) é somada a cada requisição fora do lock, então
+    requisições concorrentes se sobrepõem como num servidor real. Chaves
+    primárias e job_skill.job são indexadas para as consultas in_/eq não
+    varrerem a tabela inteira. `missing_columns` ({tabela: colunas}) simula
+    um banco sem essas colunas, com os erros do PostgREST.
+    """
+
+    INDEXED_COLUMNS = {**{table: [key] for table, key in PRIMARY_KEYS.items()}, 'job_skill': ['job']}
+
+    def __init__(self, latency=0.0, enforce_foreign_keys=True, missing_columns=None):
+        self.latency = latency
+        self.enforce_foreign_keys = enforce_foreign_keys
+        self.missing_columns = missing_columns or {}
+        self.requests = 0
+        self._tables = {}
+        self._indexes = {}
+        self._next_rowid = 0
+        self._lock = threading.Lock()
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params=None):
+        return FakeRpc(self, name, params or {})
+
+    def rows(self, table):
+        """Cópia das linhas de uma tabela (para inspeção)"""
+        with self._lock:
+            return [dict(row) for row in self._tables.get(table, {}).values()]
+
+    def _execute(self, query):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            self._check_columns(query)
+            handler = getattr(self, f"_{query.operation}")
+            return handler(query)
+
+    def _execute_rpc(self, call):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            handler = getattr(self, f"_rpc_{call.name}", None)
+            if handler is None:
+                raise _api_error("PGRST202", f"Could not find the function public.{call.name}")
+            return handler(**call.params)
+
+    def _rpc_import_jobs_batch(self, payload):
+        """Mesmo comportamento de import_jobs_batch.sql"""
+        references = [('company', 'company'), ('title_taxonomy', 'title')]
+        for table, field in references:
+            for entry in payload:
+                record = entry.get(field)
+                if record and self._find_by_key(table, record['id']) is None:
+                    self._add_row(table, dict(record, **({'latest_version': True} if table == 'title_taxonomy' else {})))
+        for entry in payload:
+            for skill in entry.get('skills') or []:
+                if self._find_by_key('skill_2_skill_pt_br', skill['id']) is None:
+                    self._add_row('skill_2_skill_pt_br', {**skill, 'latest_version': True})
+
+        results = []
+        for position, entry in enumerate(payload, start=1):
+            job = entry['job']
+            skills = {skill['id'] for skill in entry.get('skills') or [] if skill['id'] is not None}
+            try:
+                self._check_constraints('jobs', job)
+                for skill in skills:
+                    self._check_constraints('job_skill', {'skill': skill})
+            except APIError as e:
+                results.append({"item_position": position, "job_id": job['id'], "status": 'error', "error_message": e.message})
+                continue
+            current = self._find_by_key('jobs', job['id'])
+            if current is None:
+                self._add_row('jobs', dict(job))
+            else:
+                current.update(job, import_fingerprint=job.get('import_fingerprint'))
+            linked = set()
+            for rowid in list(self._index('job_skill', 'job').get(job['id'], ())):
+                skill = self._store('job_skill')[rowid].get('skill')
+                if skill is not None and skill not in skills:
+                    self._remove_row('job_skill', rowid)
+                else:
+                    linked.add(skill)
+            for skill in sorted(skills - linked):
+                self._add_row('job_skill', {'job': job['id'], 'skill': skill})
+            results.append({
+                "item_position": position, "job_id": job['id'],
+                "status": 'inserted' if current is None else 'updated', "error_message": None,
+            })
+        return FakeResponse(results)
+
+    # Armazenamento
+    def _store(self, table):
+        return self._tables.setdefault(table, {})
+
+    def _index(self, table, column):
+        return self._indexes.setdefault(table, {}).setdefault(column, {})
+
+    def _add_row(self, table, row):
+        rowid = self._next_rowid
+        self._next_rowid += 1
+        self._store(table)[rowid] = row
+        for column in self.INDEXED_COLUMNS.get(table, []):
+            self._index(table, column).setdefault(row.get(column), set()).add(rowid)
+
+    def _remove_row(self, table, rowid):
+        row = self._store(table).pop(rowid)
+        for column in self.INDEXED_COLUMNS.get(table, []):
+            self._index(table, column).get(row.get(column), set()).discard(rowid)
+
+    def _find_by_key(self, table, value):
+        key = PRIMARY_KEYS[table]
+        rowids = self._index(table, key).get(value)
+        return self._store(table)[next(iter(rowids))] if rowids else None
+
+    def _candidates(self, query):
+        store = self._store(query.table)
+        indexed = self.INDEXED_COLUMNS.get(query.table, [])
+        for column, values in query.hints:
+            if column in indexed:
+                index = self._index(query.table, column)
+                rowids = set()
+                for value in values:
+                    rowids.update(index.get(value, ()))
+                return [(rowid, store[rowid]) for rowid in sorted(rowids)]
+        return list(store.items())
+
+    def _matches(self, query, row):
+        return all(condition(row) for condition in query.filters)
+
+    def _matching(self, query):
+        return [(rowid, row) for rowid, row in self._candidates(query) if self._matches(query, row)]
+
+    # Operações
+    def _select(self, query):
+        rows = [row for _, row in self._matching(query)]
+        count = len(rows) if query.count else None
+        if query.row_limit is not None:
+            rows = rows[:query.row_limit]
+        if query.columns != '*':
+            columns = [column.strip() for column in query.columns.split(',')]
+            rows = [{column: row.get(column) for column in columns} for row in rows]
+        return FakeResponse(copy.deepcopy(rows), count)
+
+    def _check_columns(self, query):
+        missing = self.missing_columns.get(query.table, ())
+        if query.operation == 'select' and query.columns != '*':
+            for column in query.columns.split(','):
+                if column.strip() in missing:
+                    raise _api_error("42703", f"column {query.table}.{column.strip()} does not exist")
+        records = query.payload if isinstance(query.payload, list) else [query.payload or {}]
+        for record in records:
+            for column in record:
+                if column in missing:
+                    raise _api_error("PGRST204", f"Could not find the '{column}' column of '{query.table}' in the schema cache")
+
+    def _check_constraints(self, table, record):
+        for column, limit in VARCHAR_LIMITS.get(table, {}).items():
+            value = record.get(column)
+            if isinstance(value, str) and len(value) > limit:
+                raise _api_error("22001", f"value too long for type character varying({limit})")
+        if not self.enforce_foreign_keys:
+            return
+        for source, column, target in FOREIGN_KEYS:
+            if source != table or record.get(column) is None:
+                continue
+            if self._find_by_key(target, record[column]) is None:
+                raise _api_error(
+                    "23503",
+                    f'insert or update on table "{table}" violates foreign key constraint "{table}_{column}_fkey"',
+                    f'Key ({column})=({record[column]}) is not present in table "{target}".',
+                )
+
+    def _insert(self, query):
+        records = query.payload if isinstance(query.payload, list) else [query.payload]
+        key = PRIMARY_KEYS.get(query.table)
+        seen = set()
+        for record in records:
+            if key and (record.get(key) in seen or self._find_by_key(query.table, record.get(key))):
+                raise _api_error("23505", f'duplicate key value violates unique constraint "{query.table}_pkey"')
+            if key:
+                seen.add(record.get(key))
+            self._check_constraints(query.table, record)
+        for record in records:
+            self._add_row(query.table, dict(record))
+        return FakeResponse(copy.deepcopy(records))
+
+    def _upsert(self, query):
+        records = query.payload if isinstance(query.payload, list) else [query.payload]
+        key = query.on_conflict
+        keys = [record.get(key) for record in records]
+        if len(set(keys)) != len(keys) and not query.ignore_duplicates:
+            raise _api_error("21000", "ON CONFLICT DO UPDATE command cannot affect row a second time")
+        for record in records:
+            self._check_constraints(query.table, record)
+        for record in records:
+            current = self._find_by_key(query.table, record.get(key))
+            if current is None:
+                self._add_row(query.table, dict(record))
+            elif not query.ignore_duplicates:
+                current.update(record)
+        return FakeResponse(copy.deepcopy(records))
+
+    def _update(self, query):
+        updated = []
+        for _, row in self._matching(query):
+            self._check_constraints(query.table, {**row, **query.payload})
+            row.update(query.payload)
+            updated.append(dict(row))
+        return FakeResponse(updated)
+
+    def _delete(self, query):
+        deleted = []
+        for rowid, row in self._matching(query):
+            self._remove_row(query.table, rowid)
+            deleted.append(row)
+        if query.table == 'jobs':
+            # on delete cascade de job_skill
+            for job_id in {row['id'] for row in deleted}:
+                for rowid in list(self._index('job_skill', 'job').get(job_id, ())):
+                    self._remove_row('job_skill', rowid)
+        return FakeResponse(deleted)
@@ -0,0 +1,89 @@
+"""Gera arquivos sintéticos no formato do import-test.csv (export de jobs do Snowflake).
+
+Uso:
+    python -m benchmarks.generate_data saida.csv --rows 100000
+"""
+import argparse
+import csv
+import json
+import os
+import random
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'import-test.csv')
+
+ARRAY_COLUMNS = [
+    ('SPECIALIZED_SKILLS', 'SPECIALIZED_SKILLS_NAME'),
+    ('COMMON_SKILLS', 'COMMON_SKILLS_NAME'),
+    ('SOFTWARE_SKILLS', 'SOFTWARE_SKILLS_NAME'),
+    ('CERTIFICATIONS', 'CERTIFICATIONS_NAME'),
+]
+
+def _snowflake_array(values):
+    """Formata uma lista como o Snowflake exporta arrays (JSON indentado)"""
+    return json.dumps(values, indent=2, ensure_ascii=False)
+
+def load_template():
+    with open(TEMPLATE_PATH, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        return reader.fieldnames, next(reader)
+
+def generate_csv(path, rows, seed=0, companies=5000, titles=2000, skills=20000,
+                 duplicate_ratio=0.02, body_chars=2000):
+    """Escreve `rows` linhas sintéticas em `path`, em streaming.
+
+    Companies, titles e skills são sorteados de conjuntos limitados, como num
+    export real; `duplicate_ratio` repete ids já emitidos com outra data.
+    """
+    rng = random.Random(seed)
+    fieldnames, template = load_template()
+    body = (template['BODY'] * (body_chars // max(len(template['BODY']), 1) + 1))[:body_chars]
+    skill_pool = [f"KS{n:018d}" for n in range(skills)]
+    emitted = []
+
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for n in range(rows):
+            row = dict(template)
+            if emitted and rng.random() < duplicate_ratio:
+                row['ID'] = rng.choice(emitted)
+            else:
+                row['ID'] = f"{n:040x}"
+                if len(emitted) < 100000:
+                    emitted.append(row['ID'])
+            row['LAST_UPDATED_DATE'] = f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+            row['BODY'] = body
+            company = rng.randrange(1, companies + 1)
+            row['COMPANY'] = str(company)
+            row['COMPANY_NAME'] = f"Company {company}"
+            title = rng.randrange(titles)
+            row['TITLE'] = f"ET{title:016X}"
+            row['TITLE_NAME'] = f"Title {title}"
+
+            job_skills = rng.sample(skill_pool, rng.randint(0, 20))
+            row['SKILLS'] = _snowflake_array(job_skills)
+            row['SKILLS_NAME'] = _snowflake_array([f"Skill {skill[2:].lstrip('0') or '0'}" for skill in job_skills])
+            for ids_column, names_column in ARRAY_COLUMNS:
+                subset = job_skills[:rng.randint(0, len(job_skills))] if ids_column != 'CERTIFICATIONS' else []
+                row[ids_column] = _snowflake_array(subset)
+                row[names_column] = _snowflake_array([f"Skill {skill[2:].lstrip('0') or '0'}" for skill in subset])
+
+            low = rng.choice(['', '1', '2', '3', '5'])
+            row['MIN_YEARS_EXPERIENCE'] = low
+            row['MAX_YEARS_EXPERIENCE'] = str(int(low) + rng.randint(0, 5)) if low else ''
+            writer.writerow(row)
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera um CSV sintético de jobs")
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--body-chars", type=int, default=2000)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.02)
+    args = parser.parse_args(argv)
+    generate_csv(args.path, args.rows, seed=args.seed, body_chars=args.body_chars,
+                 duplicate_ratio=args.duplicate_ratio)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Benchmark do importador contra o cliente Supabase falso (em memória, com latência simulada).
+
+Uso:
+    python -m benchmarks.run_benchmark                       # 1k linhas, rápido
+    python -m benchmarks.run_benchmark --preset full         # 1k, 100k e 1M linhas
+    python -m benchmarks.run_benchmark --sizes 100000 --batch-sizes 50 200 --concurrency 1 8 \\
+        --latency-ms 20 --output resultado.json --baseline anterior.json
+
+Cada combinação roda num subprocesso, para medir o pico de memória (RSS) isoladamente.
+Com `--baseline`, termina com erro se alguma combinação ficar mais lenta que o limite.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.generate_data import generate_csv
+
+PRESETS = {
+    'quick': [1000],
+    'full': [1000, 100000, 1000000],
+}
+
+def run_one(path, batch_size, concurrency, latency, adaptive, delta, rpc, parse_workers):
+    """Roda uma importação completa contra o cliente falso e retorna as métricas"""
+    from benchmarks.fake_supabase import FakeSupabase
+    from utils.batch_controller import AdaptiveBatchController
+    from utils.importer import initialize_metrics, run_import
+    from utils.instrumentation import pipeline_metrics
+    from utils.reference_cache import ReferenceCache
+
+    supabase = FakeSupabase(latency=latency)
+    controller = AdaptiveBatchController(batch_size, enabled=adaptive)
+    stats = initialize_metrics()
+    before = pipeline_metrics.snapshot()
+    started = time.perf_counter()
+    rows = 0
+    batches = run_import(
+        path, supabase, ReferenceCache(), controller, concurrency, stats, delta=delta, rpc=rpc, parse_workers=parse_workers
+    )
+    for batch_df, _ in batches:
+        rows += len(batch_df)
+    elapsed = time.perf_counter() - started
+    report = pipeline_metrics.since(before)
+    return {
+        "rows": rows,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed, 1) if elapsed else None,
+        "requests": supabase.requests,
+        "requests_per_row": round(supabase.requests / rows, 4) if rows else None,
+        "final_batch_size": controller.batch_size,
+        "stats": stats,
+        "stages": {name: round(entry["seconds"], 3) for name, entry in report["stages"].items()},
+    }
+
+def run_in_subprocess(path, batch_size, concurrency, latency, adaptive, delta, rpc, parse_workers):
+    """Roda `run_one` num processo filho e acrescenta o pico de RSS dele"""
+    command = [
+        sys.executable, "-m", "benchmarks.run_benchmark", "--run-one", path,
+        "--batch-sizes", str(batch_size), "--concurrency", str(concurrency),
+        "--latency-ms", str(latency * 1000), "--parse-workers", str(parse_workers),
+    ]
+    if adaptive:
+        command.append("--adaptive")
+    if delta:
+        command.append("--delta")
+    if rpc:
+        command.append("--rpc")
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, cwd=os.getcwd())
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"Benchmark falhou ({process.returncode}): {' '.join(command)}")
+    result = json.loads(output)
+    # ru_maxrss é em KiB no Linux e em bytes no macOS
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    result["peak_rss_mb"] = round(usage.ru_maxrss / divisor, 1)
+    return result
+
+def ensure_data_file(data_dir, rows, body_chars):
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"jobs-{rows}-{body_chars}.csv")
+    if not os.path.exists(path):
+        print(f"Gerando {path}...", file=sys.stderr)
+        generate_csv(path, rows, body_chars=body_chars)
+    return path
+
+def find_regressions(results, baseline, max_regression):
+    """Combinações cujo rows/sec caiu mais que `max_regression` em relação à base"""
+    def key(result):
+        return (result["size"], result["batch_size"], result["concurrency"], result["latency_ms"])
+    previous = {key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old and old["rows_per_second"] and result["rows_per_second"] < old["rows_per_second"] * (1 - max_regression):
+            regressions.append((result, old))
+    return regressions
+
+TABLE_HEADER = f"{'linhas':>9} {'lote':>5} {'conc':>4} {'lat ms':>6} {'linhas/s':>10} {'req/linha':>9} {'RSS MB':>7} {'erros':>6}"
+
+def print_row(result):
+    print(
+        f"{result['size']:>9} {result['batch_size']:>5} {result['concurrency']:>4} {result['latency_ms']:>6g} "
+        f"{result['rows_per_second']:>10} {result['requests_per_row']:>9} {result['peak_rss_mb']:>7} "
+        f"{result['stats']['erros']:>6}",
+        file=sys.stderr,
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do importador com Supabase simulado")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    parser.add_argument("--sizes", type=int, nargs="+", help="número de linhas (substitui o preset)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="latência simulada por requisição")
+    parser.add_argument("--adaptive", action="store_true", help="usa o tamanho de lote adaptativo")
+    parser.add_argument("--delta", action="store_true", help="importa só registros alterados")
+    parser.add_argument("--rpc", action="store_true", help="grava cada lote com a função import_jobs_batch")
+    parser.add_argument("--parse-workers", type=int, default=0, help="processos de parsing (0 = na thread de gravação)")
+    parser.add_argument("--body-chars", type=int, default=2000, help="tamanho do BODY sintético")
+    parser.add_argument("--data-dir", default=".bench_data")
+    parser.add_argument("--output", help="grava os resultados em JSON")
+    parser.add_argument("--baseline", help="resultados anteriores (JSON) para detectar regressão")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="queda máxima aceita de linhas/s em relação à base (default: %(default)s)")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    latency = args.latency_ms / 1000
+    if args.run_one:
+        result = run_one(args.run_one, args.batch_sizes[0], args.concurrency[0], latency, args.adaptive, args.delta, args.rpc,
+                         args.parse_workers)
+        print(json.dumps(result))
+        return 0
+
+    results = []
+    print(TABLE_HEADER, file=sys.stderr)
+    for size in args.sizes or PRESETS[args.preset]:
+        path = ensure_data_file(args.data_dir, size, args.body_chars)
+        for batch_size in args.batch_sizes:
+            for concurrency in args.concurrency:
+                result = run_in_subprocess(
+                    path, batch_size, concurrency, latency, args.adaptive, args.delta, args.rpc, args.parse_workers
+                )
+                result.update(size=size, batch_size=batch_size, concurrency=concurrency, latency_ms=args.latency_ms)
+                results.append(result)
+                print_row(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = find_regressions(results, json.load(f), args.max_regression)
+        for result, old in regressions:
+            print(
+                f"REGRESSÃO: {result['size']} linhas, lote {result['batch_size']}, conc {result['concurrency']}: "
+                f"{old['rows_per_second']} -> {result['rows_per_second']} linhas/s",
+                file=sys.stderr,
+            )
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Importador de jobs pela linha de comando, sem Streamlit.
+
+Uso:
+    python import_job_cli.py arquivo.csv --batch-size 50 --concurrency 4
+
+O progresso e o resumo são escritos em stdout como linhas JSON; os logs vão para stderr.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from utils.batch_controller import AdaptiveBatchController, retry_stats
+from utils.constants import BATCH_SIZE_ADAPTIVE_MAX, BATCH_SIZE_DEFAULT, CONCURRENCY_DEFAULT
+from utils.file_loader import estimate_rows
+from utils.import_journal import ImportJournal
+from utils.importer import initialize_metrics, run_import
+from utils.instrumentation import pipeline_metrics, report_json
+from utils.outcome_ledger import OutcomeLedger
+from utils.parse_pool import default_parse_workers
+from utils.postgres_loader import run_bulk_load
+from utils.reference_cache import ReferenceCache
+from utils.supabase_handler import SupabaseClientPool
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Importa um export de jobs do Snowflake (CSV, CSV gzip, Parquet ou Arrow) para o Supabase")
+    parser.add_argument("file", help="caminho do arquivo (.csv, .csv.gz, .parquet, .arrow)")
+    parser.add_argument("--loader", choices=["rest", "rpc", "copy"], default="rest",
+                        help="rest: API do Supabase em lotes; rpc: uma chamada à função import_jobs_batch por lote; "
+                             "copy: COPY direto no Postgres numa única transação (default: %(default)s)")
+    parser.add_argument("--database-url", help="URL do Postgres para --loader copy (default: $SUPABASE_DB_URL)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE_DEFAULT,
+                        help="tamanho inicial do lote (default: %(default)s)")
+    parser.add_argument("--max-batch-size", type=int, default=BATCH_SIZE_ADAPTIVE_MAX,
+                        help="tamanho máximo do lote no modo adaptativo (default: %(default)s)")
+    parser.add_argument("--fixed-batch-size", action="store_true",
+                        help="desliga o ajuste automático do tamanho do lote")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY_DEFAULT,
+                        help="lotes processados em paralelo (default: %(default)s)")
+    parser.add_argument("--parse-workers", type=int, default=default_parse_workers(),
+                        help="processos que preparam os lotes enquanto outros são gravados; 0 prepara na "
+                             "thread de gravação (default: %(default)s)")
+    parser.add_argument("--progress-interval", type=float, default=1.0,
+                        help="segundos entre linhas de progresso (default: %(default)s)")
+    parser.add_argument("--changed-only", action="store_true",
+                        help="pula jobs idênticos ao que já está no banco (requer jobs.import_fingerprint)")
+    parser.add_argument("--keep-duplicates", action="store_true",
+                        help="grava todas as linhas de IDs repetidos, em vez de só a de LAST_UPDATED_DATE mais recente")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="ignora o diário e importa o arquivo do zero")
+    parser.add_argument("--journal-dir", help="diretório dos diários de importação (default: $IMPORT_JOURNAL_DIR ou .import_journal)")
+    parser.add_argument("--summary-file", help="grava o resumo final em JSON neste arquivo")
+    parser.add_argument("--metrics-file", help="grava o relatório de tempo por etapa e requisições em JSON")
+    parser.add_argument("--errors-file", help="grava as mensagens de erro, uma por linha, neste arquivo")
+    parser.add_argument("--outcomes-file", help="grava em CSV o resultado de cada linha do arquivo (novo, erro, ...)")
+    parser.add_argument("--log-level", default="WARNING", help="nível de log em stderr (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if args.loader == "copy" and args.changed_only:
+        parser.error("--changed-only não se aplica a --loader copy")
+    return args
+
+def emit(event, **data):
+    """Escreve um evento JSON em stdout"""
+    print(json.dumps({"event": event, **data}, ensure_ascii=False), flush=True)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), stream=sys.stderr,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    controller = AdaptiveBatchController(
+        args.batch_size, maximum=args.max_batch_size, enabled=not args.fixed_batch_size
+    )
+    ledger = OutcomeLedger() if args.outcomes_file else None
+    if args.loader == "copy":
+        # Uma única transação: não há lotes parciais para retomar
+        journal = None
+        stats = initialize_metrics()
+        batches = run_bulk_load(args.file, stats, args.database_url, not args.keep_duplicates, ledger)
+    else:
+        # Um cliente por lote em paralelo, com as conexões reaproveitadas entre os lotes
+        supabase = SupabaseClientPool(size=args.concurrency)
+        reference_cache = ReferenceCache(snapshot_path=os.getenv("REFERENCE_CACHE_SNAPSHOT"))
+        with supabase.client() as client:
+            reference_cache.load_snapshot(client)
+        journal = ImportJournal.for_file(args.file, args.journal_dir)
+        if args.no_resume:
+            journal.reset()
+        stats = journal.merge_into(initialize_metrics())
+        batches = run_import(
+            args.file, supabase, reference_cache, controller, args.concurrency, stats, journal,
+            args.changed_only, args.loader == "rpc", not args.keep_duplicates, args.parse_workers, ledger
+        )
+    stats["total"] = estimate_rows(args.file)
+    emit("start", file=args.file, loader=args.loader, estimated_rows=stats["total"],
+         resumed_rows=journal.rows_done if journal else 0,
+         content_hash=journal.content_hash if journal else None)
+
+    errors_file = open(args.errors_file, "w", encoding="utf-8") if args.errors_file else None
+    metrics_before = pipeline_metrics.snapshot()
+    started = time.perf_counter()
+    last_progress = 0.0
+    rows_read = journal.rows_done if journal else 0
+    try:
+        for batch_df, errors in batches:
+            rows_read += len(batch_df)
+            stats["total"] = max(stats["total"], rows_read + stats["duplicados"])
+            if errors_file:
+                errors_file.writelines(f"{error}\n" for error in errors)
+
+            now = time.perf_counter()
+            if now - last_progress >= args.progress_interval:
+                last_progress = now
+                emit("progress", rows_read=rows_read + stats["duplicados"], batch_size=controller.batch_size,
+                     elapsed_seconds=round(now - started, 3), **stats)
+    finally:
+        if errors_file:
+            errors_file.close()
+
+    stats["total"] = rows_read + stats["duplicados"]
+    if args.loader != "copy":
+        try:
+            with supabase.client() as client:
+                reference_cache.save_snapshot(client)
+        except Exception as e:
+            logging.warning(f"Não foi possível salvar o cache de referências: {str(e)}")
+        supabase.close()
+
+    elapsed = time.perf_counter() - started
+    report = pipeline_metrics.since(metrics_before)
+    requests = sum(entry["count"] for entry in report["requests"].values())
+    summary = {
+        **stats,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(rows_read / elapsed, 1) if elapsed else None,
+        "final_batch_size": controller.batch_size,
+        "requests": requests,
+        **retry_stats.snapshot(),
+    }
+    if args.loader != "copy":
+        summary["client_pool"] = supabase.stats()
+    emit("summary", **summary)
+    if args.metrics_file:
+        with open(args.metrics_file, "w", encoding="utf-8") as f:
+            f.write(report_json(report, rows=rows_read, elapsed_seconds=round(elapsed, 3)))
+    if args.outcomes_file:
+        with open(args.outcomes_file, "w", encoding="utf-8", newline="") as f:
+            f.writelines(ledger.iter_csv())
+    if args.summary_file:
+        with open(args.summary_file, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,22 @@
 import streamlit as st
 import pandas as pd
-from utils.data_processor import prepare_job_data, process_skills
-from utils.supabase_handler import init_supabase, verify_company, verify_title, insert_or_update_job
-import time
-from datetime import datetime
+from utils.importer import initialize_metrics
+from utils.import_runner import ImportManager, run_import_job
+from utils.supabase_handler import SupabaseClientPool
+from utils.reference_cache import ReferenceCache
+from utils.file_loader import estimate_rows, read_preview
+from utils.import_journal import ImportJournal, file_hash
+from utils.batch_controller import AdaptiveBatchController
+from utils.constants import CONCURRENCY_DEFAULT, CONCURRENCY_MAX, ERRORS_PAGE_SIZE, UI_REFRESH_SECONDS
+from utils.instrumentation import report_json, report_rows
+from utils.parse_pool import default_parse_workers
+from utils.postgres_loader import bulk_load_available
+from functools import partial
+import logging
+import math
+import os
+import shutil
+import tempfile
 
 # Configuração da página
 st.set_page_config(
@@ -13,52 +26,156 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Cache da conexão Supabase
+# Pool de clientes Supabase, compartilhado entre sessões
 @st.cache_resource
 def get_supabase():
-    return init_supabase()
-
-# Cache para leitura do CSV
-@st.cache_data
-def load_csv(file):
-    return pd.read_csv(file, dtype=str)
-
-def initialize_metrics():
-    """Inicializa as métricas com valores zero"""
-    return {
-        "total": 0,
-        "processados": 0,
-        "atualizados": 0,
-        "novos": 0,
-        "erros": 0
-    }
-
-def process_batch(df_batch, supabase, stats):
-    """Processa um lote de dados"""
-    error_messages = []
-    
-    for index, row in df_batch.iterrows():
-        try:
-            print(f"\nProcessando linha {index + 1}")
-            print(f"ID do Job: {row['ID']}")
-            
-            result = insert_or_update_job(row, supabase)
-            
-            if result in ['inserted', 'updated']:
-                process_skills(row, supabase)
-                stats["processados"] += 1
-                if result == 'inserted':
-                    stats["novos"] += 1
-                else:
-                    stats["atualizados"] += 1
-            
-        except Exception as e:
-            stats["erros"] += 1
-            error_message = f"Erro na linha {index + 1}, Job ID {row.get('ID', 'desconhecido')}: {str(e)}"
-            print(error_message)
-            error_messages.append(error_message)
-    
-    return stats, error_messages
+    return SupabaseClientPool()
+
+# Cache dos ids de company, title e skill, compartilhado entre sessões
+@st.cache_resource
+def get_reference_cache():
+    cache = ReferenceCache(snapshot_path=os.getenv("REFERENCE_CACHE_SNAPSHOT"))
+    with get_supabase().client() as client:
+        cache.load_snapshot(client)
+    return cache
+
+# Importações em segundo plano, compartilhadas entre sessões e reruns
+@st.cache_resource
+def get_import_manager():
+    return ImportManager()
+
+# Handler dos logs de utils, instalado uma vez por processo: sem ele, os registros
+# abaixo de WARNING iriam para o logging.lastResort, que os descarta
+@st.cache_resource
+def get_utils_logger():
+    logger = logging.getLogger("utils")
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(handler)
+    logger.propagate = False
+    return logger
+
+def save_upload(uploaded_file):
+    """Copia o upload para um arquivo temporário, lido pela thread da importação"""
+    suffix = ''.join(os.path.splitext(uploaded_file.name)[1:]) or '.csv'
+    uploaded_file.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as f:
+        shutil.copyfileobj(uploaded_file, f)
+    uploaded_file.seek(0)
+    return f.name
+
+def show_progress(snapshot):
+    """Métricas, barra de progresso e situação do lote de uma importação"""
+    stats = snapshot["stats"]
+    col1, col2, col3, col4, col5, col6, col7 = st.columns(7)
+    col1.metric("Total", stats["total"])
+    col2.metric("Processados", stats["processados"],
+                f"{(stats['processados']/max(stats['total'], 1)*100):.1f}%")
+    col3.metric("Atualizados", stats["atualizados"])
+    col4.metric("Novos", stats["novos"])
+    col5.metric("Inalterados", stats["inalterados"])
+    col6.metric("Duplicados", stats["duplicados"])
+    col7.metric("Erros", stats["erros"])
+    st.progress(min(snapshot["rows_read"] / max(stats["total"], 1), 1.0))
+    if snapshot["loader"] == 'copy':
+        st.caption(f"Copiando para o staging: {snapshot['rows_read']} linhas lidas")
+    else:
+        st.caption(
+            f"Lote atual: {snapshot['batch_size']} linhas · "
+            f"Retentativas: {snapshot['retries']} · "
+            f"Falhas após retentativas: {snapshot['gave_up']}"
+        )
+
+@st.fragment(run_every=UI_REFRESH_SECONDS)
+def live_progress(import_id):
+    """Atualiza o progresso num ritmo fixo, independente de quantos lotes terminaram"""
+    status = get_import_manager().get(import_id)
+    snapshot = status.snapshot()
+    show_progress(snapshot)
+    if st.button("⏹️ Cancelar importação", key=f"cancel_{import_id}"):
+        status.cancel()
+    if snapshot["state"] != 'running':
+        # Terminou: redesenha a página inteira com o resultado
+        st.rerun()
+
+def show_errors_table(status):
+    """Erros da importação numa tabela paginada, filtrável por código e por texto"""
+    ledger = status.ledger
+    codes = ledger.error_codes()
+    with st.expander(f"❌ Erros encontrados ({sum(codes.values())})"):
+        col1, col2 = st.columns(2)
+        code = col1.selectbox("Código do erro", [None] + list(codes), key=f"error_code_{status.import_id}",
+                              format_func=lambda code: "Todos" if code is None else f"{code} ({codes[code]})")
+        search = col2.text_input("Buscar Job ID ou mensagem", key=f"error_search_{status.import_id}")
+        total, _ = ledger.errors(limit=0, code=code, search=search)
+        pages = max(1, math.ceil(total / ERRORS_PAGE_SIZE))
+        page = st.number_input("Página", 1, pages, 1, key=f"error_page_{status.import_id}")
+        _, rows = ledger.errors((page - 1) * ERRORS_PAGE_SIZE, ERRORS_PAGE_SIZE, code, search)
+        st.dataframe(pd.DataFrame(rows, columns=["linha", "job_id", "codigo_erro", "erro"]), hide_index=True)
+        st.caption(f"{total} linhas com erro · página {page} de {pages}")
+
+def show_result(status, show_errors):
+    """Resultado de uma importação que já terminou"""
+    snapshot = status.snapshot()
+    stats = snapshot["stats"]
+    show_progress(snapshot)
+
+    if snapshot["state"] == 'failed':
+        st.error(f"Erro ao processar arquivo: {snapshot['failure']}")
+        return
+
+    # Tempo por etapa e requisições por tabela desta importação
+    report = snapshot["report"]
+    if report:
+        elapsed = report["elapsed"]
+        with st.expander("⏱️ Instrumentação"):
+            stage_rows, request_rows = report_rows(report["metrics"], snapshot["rows_read"], elapsed)
+            st.caption(f"Tempo total: {elapsed:.1f}s · tempos das etapas somados entre as threads e os processos de parsing; array_parsing está contido em prepare_job_data")
+            st.dataframe(pd.DataFrame(stage_rows), hide_index=True)
+            st.dataframe(pd.DataFrame(request_rows), hide_index=True)
+            pool = report.get("client_pool")
+            if pool:
+                st.caption(
+                    f"Clientes Supabase: {pool['created']} de {pool['size']} criados · pico em uso: {pool['peak_in_use']} · "
+                    f"esperas por um cliente livre: {pool['waits']} ({pool['wait_seconds']:.1f}s)"
+                )
+            st.download_button(
+                "Baixar relatório (JSON)",
+                report_json(report["metrics"], rows=snapshot["rows_read"], elapsed_seconds=round(elapsed, 3)),
+                file_name="relatorio-importacao.json",
+                mime="application/json",
+                key=f"report_{status.import_id}",
+            )
+
+    # Mostra erros se houver
+    if show_errors and snapshot["error_count"]:
+        show_errors_table(status)
+
+    # O CSV só é gerado quando o botão é clicado; o Streamlit entrega o download
+    # inteiro da memória, então arquivos enormes ficam melhor com --outcomes-file
+    st.download_button(
+        "Baixar resultado por linha (CSV)",
+        status.ledger.csv_bytes,
+        file_name="resultado-importacao.csv",
+        mime="text/csv",
+        key=f"outcomes_{status.import_id}",
+    )
+
+    if snapshot["state"] == 'cancelled':
+        st.warning("Importação cancelada; os lotes já gravados são retomados na próxima execução.")
+        return
+
+    # Resultado final
+    st.success(f"""
+        ✅ Processamento concluído!
+        - Total processado: {stats['total']}
+        - Sucessos: {stats['processados']}
+        - Atualizados: {stats['atualizados']}
+        - Novos: {stats['novos']}
+        - Inalterados: {stats['inalterados']}
+        - Duplicados no arquivo: {stats['duplicados']}
+        - Erros: {stats['erros']}
+    """)
 
 def main():
     st.title("🚀 Importador de Jobs para Supabase")
@@ -66,72 +183,112 @@ def main():
     # Configurações na sidebar
     with st.sidebar:
         st.header("⚙️ Configurações")
+        loader = st.radio("Modo de gravação", ["API do Supabase", "Função RPC no banco", "COPY direto no Postgres"],
+                          help="RPC grava cada lote numa chamada à função import_jobs_batch (import_jobs_batch.sql); "
+                               "COPY grava o arquivo inteiro numa única transação (requer psycopg e SUPABASE_DB_URL)")
+        rpc = loader == "Função RPC no banco"
+        bulk_load = loader == "COPY direto no Postgres"
+        if bulk_load and not bulk_load_available():
+            st.warning("Instale o pacote psycopg para usar a carga direta no Postgres")
         batch_size = st.slider("Tamanho do lote", 1, 100, 10)
+        adaptive_batch = st.checkbox("Ajustar tamanho do lote automaticamente", value=True)
+        max_in_flight = st.slider("Lotes em paralelo", 1, CONCURRENCY_MAX, CONCURRENCY_DEFAULT)
+        parse_workers = st.slider("Processos de parsing", 0, os.cpu_count() or 1, default_parse_workers(),
+                                  help="Preparam os próximos lotes em outros núcleos enquanto os atuais são gravados; "
+                                       "0 prepara cada lote na thread que o grava")
+        resume = st.checkbox("Retomar importação interrompida", value=True)
+        delta = st.checkbox("Importar só registros alterados", value=False,
+                            help="Pula jobs idênticos ao que já está no banco (requer a coluna jobs.import_fingerprint)")
+        dedupe = st.checkbox("Manter só a versão mais nova de IDs repetidos", value=True,
+                             help="Linhas com o mesmo ID são reduzidas à de LAST_UPDATED_DATE mais recente antes da gravação")
         show_errors = st.checkbox("Mostrar Erros Detalhados", value=True)
+        log_level = st.selectbox("Nível de log", ["WARNING", "INFO", "DEBUG"], index=0,
+                                 help="DEBUG registra cada linha processada (deixa a importação mais lenta)")
+        get_utils_logger().setLevel(log_level)
     
     # Upload do arquivo
-    uploaded_file = st.file_uploader("Escolha o arquivo CSV", type="csv")
+    uploaded_file = st.file_uploader("Escolha o arquivo (CSV, CSV gzip, Parquet ou Arrow)",
+                                     type=["csv", "gz", "parquet", "arrow", "arrows", "feather"])
     
     if uploaded_file:
         try:
-            df = load_csv(uploaded_file)
-            st.info(f"Arquivo carregado com {len(df)} registros")
+            # O arquivo é lido em pedaços: só o preview e uma estimativa do total ficam em memória
+            estimated_rows = estimate_rows(uploaded_file)
+            st.info(f"Arquivo carregado com aproximadamente {estimated_rows} registros")
+
+            # O diário é identificado pelo conteúdo; o hash é calculado uma vez por upload
+            hash_key = f"file_hash_{uploaded_file.file_id}"
+            if hash_key not in st.session_state:
+                st.session_state[hash_key] = file_hash(uploaded_file)
+            journal = ImportJournal(st.session_state[hash_key])
+            if bulk_load:
+                st.info("Na carga direta o arquivo é gravado numa única transação; a retomada e o modo de registros alterados não se aplicam.")
+            elif resume and journal.complete:
+                st.info("Este arquivo já foi importado por completo. Desmarque 'Retomar importação interrompida' para importar de novo.")
+            elif resume and journal.rows_done:
+                st.info(f"{journal.rows_done} registros já foram importados numa execução anterior; a importação continua de onde parou.")
             
             # Preview dos dados
             with st.expander("📊 Preview dos dados"):
-                st.dataframe(df.head())
+                st.dataframe(read_preview(uploaded_file))
             
             if st.button("🚀 Iniciar Processamento"):
-                supabase = get_supabase()
-                stats = initialize_metrics()
-                stats["total"] = len(df)
-                
-                # Containers para métricas e progresso
-                col1, col2, col3, col4, col5 = st.columns(5)
-                progress_bar = st.progress(0)
-                error_container = st.empty()
-                
-                # Processamento em lotes
-                all_errors = []
-                for i in range(0, len(df), batch_size):
-                    batch_df = df.iloc[i:i+batch_size]
-                    
-                    # Processa o lote
-                    stats, errors = process_batch(batch_df, supabase, stats)
-                    all_errors.extend(errors)
-                    
-                    # Atualiza métricas
-                    col1.metric("Total", stats["total"])
-                    col2.metric("Processados", stats["processados"], 
-                              f"{(stats['processados']/stats['total']*100):.1f}%")
-                    col3.metric("Atualizados", stats["atualizados"])
-                    col4.metric("Novos", stats["novos"])
-                    col5.metric("Erros", stats["erros"])
-                    
-                    # Atualiza barra de progresso
-                    progress = (i + len(batch_df)) / len(df)
-                    progress_bar.progress(progress)
-                    
-                    time.sleep(0.1)
-                
-                # Mostra erros se houver
-                if show_errors and all_errors:
-                    with st.expander("❌ Erros encontrados"):
-                        for error in all_errors:
-                            st.error(error)
-                
-                # Resultado final
-                st.success(f"""
-                    ✅ Processamento concluído!
-                    - Total processado: {stats['total']}
-                    - Sucessos: {stats['processados']}
-                    - Atualizados: {stats['atualizados']}
-                    - Novos: {stats['novos']}
-                    - Erros: {stats['erros']}
-                """)
-                
+                # A importação roda numa thread do servidor: continua mesmo se a página
+                # for recarregada, e outra sessão com o mesmo arquivo só a acompanha
+                import_id = st.session_state[hash_key]
+                manager = get_import_manager()
+                current = manager.get(import_id)
+                if current is not None and current.running:
+                    st.info("Este arquivo já está sendo importado; acompanhando a importação em andamento.")
+                else:
+                    loader = 'copy' if bulk_load else 'rpc' if rpc else 'rest'
+                    if bulk_load:
+                        stats = initialize_metrics()
+                        work_options = {"dedupe": dedupe}
+                    else:
+                        if not resume:
+                            journal.reset()
+                        stats = journal.merge_into(initialize_metrics())
+                        work_options = {
+                            "supabase": get_supabase(),
+                            "reference_cache": get_reference_cache(),
+                            "controller": AdaptiveBatchController(batch_size, enabled=adaptive_batch),
+                            "max_in_flight": max_in_flight,
+                            "journal": journal,
+                            "delta": delta,
+                            "dedupe": dedupe,
+                            "parse_workers": parse_workers,
+                        }
+                    stats["total"] = estimated_rows
+                    source = save_upload(uploaded_file)
+                    manager.start(
+                        import_id, uploaded_file.name, loader, stats,
+                        partial(run_import_job, source=source, loader=loader, remove_source=True, **work_options),
+                    )
+                st.session_state["import_id"] = import_id
+
         except Exception as e:
             st.error(f"Erro ao processar arquivo: {str(e)}")
 
+    # Progresso da importação desta sessão ou de qualquer outra em andamento
+    manager = get_import_manager()
+    statuses = manager.imports()
+    watched = st.session_state.get("import_id")
+    running = [status for status in statuses if status.running]
+    if running and watched not in {status.import_id for status in running}:
+        labels = {status.import_id: f"{status.file_name} ({status.import_id[:8]})" for status in running}
+        choice = st.selectbox("Importações em andamento", [None] + list(labels),
+                              format_func=lambda import_id: "—" if import_id is None else labels[import_id])
+        if choice:
+            watched = choice
+            st.session_state["import_id"] = choice
+    status = manager.get(watched) if watched else None
+    if status is not None:
+        st.subheader(f"📦 {status.file_name}")
+        if status.running:
+            live_progress(status.import_id)
+        else:
+            show_result(status, show_errors)
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
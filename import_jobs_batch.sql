@@ -0,0 +1,183 @@
+-- Função do modo "Função RPC no banco" / --loader rpc do importador.
+--
+-- Recebe um array JSON com uma entrada por job:
+--   {"job": {...payload de jobs...}, "company": {"id", "company_name"} | null,
+--    "title": {"id", "name"} | null, "skills": [{"id", "name"}, ...]}
+-- e, numa única chamada, cria as companies, titles e skills que faltam, grava
+-- os jobs e sincroniza job_skill com as skills da entrada (só as que têm nome
+-- em SKILLS_NAME, as mesmas criadas aqui). Retorna uma linha por entrada, na mesma ordem,
+-- com status 'inserted', 'updated' ou 'error'. O erro de um job não desfaz os
+-- demais. Rode este arquivo no SQL Editor do Supabase depois de database.md.
+
+alter table public.jobs add column if not exists import_fingerprint text null;
+
+create or replace function public.import_jobs_batch(payload jsonb)
+returns table (item_position integer, job_id text, status text, error_message text)
+language plpgsql
+as $$
+declare
+  entry jsonb;
+  entry_position integer;
+  job_row public.jobs;
+  was_inserted boolean;
+  skill_ids text[];
+begin
+  -- Referências do lote inteiro de uma vez; as que já existem não são alteradas
+  insert into public.company (id, company_name)
+  select distinct on (company_id) company_id, company_name
+  from (
+    select (item->'company'->>'id')::bigint as company_id,
+           coalesce(item->'company'->>'company_name', '') as company_name
+    from jsonb_array_elements(payload) item
+    where jsonb_typeof(item->'company') = 'object'
+  ) companies
+  on conflict (id) do nothing;
+
+  insert into public.title_taxonomy (id, name, latest_version)
+  select distinct on (title_id) title_id, title_name, true
+  from (
+    select item->'title'->>'id' as title_id, coalesce(item->'title'->>'name', '') as title_name
+    from jsonb_array_elements(payload) item
+    where jsonb_typeof(item->'title') = 'object'
+  ) titles
+  on conflict (id) do nothing;
+
+  insert into public.skill_2_skill_pt_br (id, name, latest_version)
+  select distinct on (skill_id) skill_id, skill_name, true
+  from (
+    select skill->>'id' as skill_id, skill->>'name' as skill_name
+    from jsonb_array_elements(payload) item
+    cross join lateral jsonb_array_elements(coalesce(item->'skills', '[]'::jsonb)) skill
+  ) skills
+  on conflict (id) do nothing;
+
+  for entry, entry_position in
+    select value, ordinality::integer from jsonb_array_elements(payload) with ordinality
+  loop
+    item_position := entry_position;
+    job_id := entry->'job'->>'id';
+    begin
+      job_row := jsonb_populate_record(null::public.jobs, entry->'job');
+
+      -- Campos ausentes no payload não sobrescrevem o que já está gravado
+      insert into public.jobs as stored (
+        id,
+        last_updated_date,
+        body,
+        title_raw,
+        url,
+        sources,
+        language,
+        company,
+        expired,
+        posted,
+        skills,
+        title,
+        title_name,
+        title_clean,
+        nation,
+        occupation,
+        occupation_name,
+        specialized_skills,
+        specialized_skills_name,
+        common_skills,
+        common_skills_name,
+        software_skills,
+        software_skills_name,
+        certifications,
+        certifications_name,
+        remote_type,
+        max_years_experience,
+        min_years_experience,
+        last_update_import,
+        import_fingerprint
+      ) values (
+        job_row.id,
+        job_row.last_updated_date,
+        job_row.body,
+        job_row.title_raw,
+        job_row.url,
+        job_row.sources,
+        job_row.language,
+        job_row.company,
+        job_row.expired,
+        job_row.posted,
+        job_row.skills,
+        job_row.title,
+        job_row.title_name,
+        job_row.title_clean,
+        job_row.nation,
+        job_row.occupation,
+        job_row.occupation_name,
+        job_row.specialized_skills,
+        job_row.specialized_skills_name,
+        job_row.common_skills,
+        job_row.common_skills_name,
+        job_row.software_skills,
+        job_row.software_skills_name,
+        job_row.certifications,
+        job_row.certifications_name,
+        job_row.remote_type,
+        job_row.max_years_experience,
+        job_row.min_years_experience,
+        job_row.last_update_import,
+        job_row.import_fingerprint
+      )
+      on conflict (id) do update set
+        last_updated_date = coalesce(excluded.last_updated_date, stored.last_updated_date),
+        body = coalesce(excluded.body, stored.body),
+        title_raw = coalesce(excluded.title_raw, stored.title_raw),
+        url = coalesce(excluded.url, stored.url),
+        sources = coalesce(excluded.sources, stored.sources),
+        language = coalesce(excluded.language, stored.language),
+        company = coalesce(excluded.company, stored.company),
+        expired = coalesce(excluded.expired, stored.expired),
+        posted = coalesce(excluded.posted, stored.posted),
+        skills = coalesce(excluded.skills, stored.skills),
+        title = coalesce(excluded.title, stored.title),
+        title_name = coalesce(excluded.title_name, stored.title_name),
+        title_clean = coalesce(excluded.title_clean, stored.title_clean),
+        nation = coalesce(excluded.nation, stored.nation),
+        occupation = coalesce(excluded.occupation, stored.occupation),
+        occupation_name = coalesce(excluded.occupation_name, stored.occupation_name),
+        specialized_skills = coalesce(excluded.specialized_skills, stored.specialized_skills),
+        specialized_skills_name = coalesce(excluded.specialized_skills_name, stored.specialized_skills_name),
+        common_skills = coalesce(excluded.common_skills, stored.common_skills),
+        common_skills_name = coalesce(excluded.common_skills_name, stored.common_skills_name),
+        software_skills = coalesce(excluded.software_skills, stored.software_skills),
+        software_skills_name = coalesce(excluded.software_skills_name, stored.software_skills_name),
+        certifications = coalesce(excluded.certifications, stored.certifications),
+        certifications_name = coalesce(excluded.certifications_name, stored.certifications_name),
+        remote_type = coalesce(excluded.remote_type, stored.remote_type),
+        max_years_experience = coalesce(excluded.max_years_experience, stored.max_years_experience),
+        min_years_experience = coalesce(excluded.min_years_experience, stored.min_years_experience),
+        last_update_import = coalesce(excluded.last_update_import, stored.last_update_import),
+        -- O hash é sempre o do conteúdo desta importação (null se não veio)
+        import_fingerprint = excluded.import_fingerprint
+      returning (xmax = 0) into was_inserted;
+
+      -- Vincula as skills da entrada (as criadas acima), não o array jobs.skills
+      skill_ids := array(
+        select distinct skill->>'id'
+        from jsonb_array_elements(coalesce(entry->'skills', '[]'::jsonb)) skill
+        where skill->>'id' is not null
+      );
+      delete from public.job_skill link
+      where link.job = job_row.id and link.skill <> all(skill_ids);
+      insert into public.job_skill (job, skill)
+      select job_row.id, wanted.skill_id
+      from unnest(skill_ids) as wanted(skill_id)
+      where not exists (
+        select 1 from public.job_skill link where link.job = job_row.id and link.skill = wanted.skill_id
+      );
+
+      status := case when was_inserted then 'inserted' else 'updated' end;
+      error_message := null;
+    exception when others then
+      status := 'error';
+      error_message := sqlerrm;
+    end;
+    return next;
+  end loop;
+end;
+$$;
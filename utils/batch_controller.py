@@ -0,0 +1,260 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+from postgrest.exceptions import APIError
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from utils.constants import (
+    BATCH_SIZE_ADAPTIVE_MAX,
+    BATCH_TARGET_SECONDS,
+    RETRY_ATTEMPTS,
+    RETRY_WAIT_MAX_SECONDS,
+    RETRY_WAIT_MULTIPLIER,
+)
+from utils.instrumentation import pipeline_metrics
+
+logger = logging.getLogger(__name__)
+
+# Códigos do Postgres/PostgREST que indicam falha momentânea (timeout, conexão, deadlock)
+TRANSIENT_ERROR_CODES = {'57014', '40001', '40P01', '53300', 'PGRST000', 'PGRST001', 'PGRST002', 'PGRST003'}
+
+# Erros de esquema ou de permissão (coluna, tabela ou função inexistente, RLS, autenticação):
+# falham com qualquer subconjunto do lote, então dividir o lote não isola nada
+BATCH_ERROR_CODES = {
+    'PGRST202', 'PGRST204', 'PGRST205', 'PGRST301', 'PGRST302',
+    '42501', '42703', '42883', '42P01', 401, 403, '401', '403',
+}
+
+def is_transient_error(error):
+    """Indica se vale a pena repetir a requisição que gerou o erro"""
+    if isinstance(error, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)):
+        return True
+    if isinstance(error, APIError):
+        code = error.code
+        if isinstance(code, int):
+            return code >= 500 or code == 429
+        return code in TRANSIENT_ERROR_CODES or str(code).startswith('08')
+    return False
+
+def is_connection_error(error):
+    """Erros em que a requisição com certeza não chegou ao banco"""
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+class RetryStats:
+    """Contadores de retentativas, compartilhados por todas as threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.gave_up = 0
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_give_up(self):
+        with self._lock:
+            self.gave_up += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {"retries": self.retries, "gave_up": self.gave_up}
+
+# Todas as retentativas do processo; cada importação conta as suas com counting_retries
+retry_stats = RetryStats()
+
+_retry_scopes = ContextVar('retry_scopes', default=())
+
+@contextmanager
+def counting_retries(stats):
+    """Conta em `stats`, além de `retry_stats`, as retentativas feitas neste contexto.
+
+    Vale para o bloco na thread atual; com várias importações no mesmo processo,
+    cada uma conta só as retentativas das suas requisições.
+    """
+    token = _retry_scopes.set(_retry_scopes.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _retry_scopes.reset(token)
+
+def _retry_counters():
+    return (retry_stats,) + _retry_scopes.get()
+
+def _record_retry(retry_state):
+    for stats in _retry_counters():
+        stats.record_retry()
+    logger.info(f"Retentativa {retry_state.attempt_number} após erro: {retry_state.outcome.exception()}")
+
+def call_with_retry(func, idempotent=True):
+    """Executa `func` repetindo falhas transitórias com backoff exponencial e jitter.
+
+    Requisições não idempotentes (insert simples) só são repetidas quando a
+    conexão nem chegou a ser aberta, para não duplicar linhas.
+    """
+    should_retry = is_transient_error if idempotent else is_connection_error
+    retrying = Retrying(
+        retry=retry_if_exception(should_retry),
+        wait=wait_random_exponential(multiplier=RETRY_WAIT_MULTIPLIER, max=RETRY_WAIT_MAX_SECONDS),
+        stop=stop_after_attempt(RETRY_ATTEMPTS),
+        before_sleep=_record_retry,
+        reraise=True,
+    )
+    try:
+        return retrying(func)
+    except Exception as e:
+        if should_retry(e):
+            for stats in _retry_counters():
+                stats.record_give_up()
+        raise
+
+def execute_query(query, table, operation, idempotent=True):
+    """Executa uma query do cliente Supabase com retentativa de falhas transitórias.
+
+    Cada tentativa é contada em `pipeline_metrics` por tabela e operação.
+    """
+    def attempt():
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = query.execute()
+            failed = False
+            return result
+        finally:
+            pipeline_metrics.record_request(table, operation, time.perf_counter() - started, failed)
+
+    return call_with_retry(attempt, idempotent)
+
+def _is_transient_failure(error):
+    # Erros embrulhados (ex.: "Erro ao sincronizar skills: ...") guardam o original em __context__
+    while error is not None:
+        if is_transient_error(error):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+def _error_signature(error):
+    """(código, mensagem, detalhes) do erro do PostgREST dentro de `error`, ou o texto do erro"""
+    current = error
+    while current is not None:
+        if isinstance(current, APIError):
+            return current.code, current.message, current.details
+        current = current.__cause__ or current.__context__
+    return None, str(error), None
+
+def write_bisecting(positions, write):
+    """Executa `write(posições)` em lote e, se falhar, divide as posições ao meio até isolar as que falham.
+
+    Uma linha inválida (FK inexistente, valor longo demais) derruba a
+    requisição inteira; dividindo o lote, as linhas boas continuam sendo
+    gravadas em lote e cada linha ruim custa cerca de log2(n) chamadas a mais.
+
+    Não são divididas, e todas as posições da parte falham com o mesmo erro:
+    falhas transitórias que esgotaram as retentativas e erros de esquema ou de
+    permissão (BATCH_ERROR_CODES). Quando as duas metades falham com o erro
+    idêntico (código, mensagem e detalhes) por dois níveis seguidos, uma linha
+    sorteada de cada metade é gravada sozinha: se as duas falham do mesmo jeito, o erro
+    não depende das linhas e a parte inteira falha sem mais divisões.
+
+    Retorna (sucessos, falhas), uma lista de (posições, resultado de write) e
+    um dict {posição: mensagem}.
+    """
+    successes = []
+    failures = {}
+
+    def attempt(part):
+        try:
+            successes.append((part, write(part)))
+            return None
+        except Exception as e:
+            return e
+
+    def same_error(error, signature):
+        return error is not None and _error_signature(error) == signature
+
+    def bisect(part, error, uniform_levels=0, row_level=False):
+        signature = _error_signature(error)
+        if len(part) == 1 or _is_transient_failure(error) or signature[0] in BATCH_ERROR_CODES:
+            failures.update((position, str(error)) for position in part)
+            return
+        logger.debug(f"Gravação de {len(part)} linhas falhou, dividindo o lote: {error}")
+        middle = len(part) // 2
+        halves = [(half, attempt(half)) for half in (part[:middle], part[middle:])]
+
+        # Uma metade falhar como a parte é o esperado (ela tem a linha ruim); as duas, não
+        if not row_level and all(same_error(half_error, signature) for _, half_error in halves):
+            uniform_levels += 1
+            if uniform_levels >= 2:
+                # Linhas sorteadas, para um arquivo com linhas ruins em intervalos fixos não enganar o teste
+                probes = [(position, attempt([position])) for position in (random.choice(half) for half, _ in halves)]
+                if all(same_error(probe_error, signature) for _, probe_error in probes):
+                    failures.update((position, str(error)) for position in part)
+                    return
+                # O erro depende das linhas: segue dividindo, sem as linhas já testadas
+                row_level = True
+                for position, probe_error in probes:
+                    if probe_error is not None:
+                        failures[position] = str(probe_error)
+                tested = {position for position, _ in probes}
+                halves = [[position for position in half if position not in tested] for half, _ in halves]
+                halves = [(half, attempt(half)) for half in halves if half]
+        else:
+            uniform_levels = 0
+
+        for half, half_error in halves:
+            if half_error is not None:
+                bisect(half, half_error, uniform_levels, row_level)
+
+    positions = list(positions)
+    if positions:
+        error = attempt(positions)
+        if error is not None:
+            bisect(positions, error)
+    return successes, failures
+
+class AdaptiveBatchController:
+    """Ajusta o tamanho do lote pela latência observada e pelas falhas transitórias.
+
+    Cresce 25% enquanto os lotes terminam abaixo do tempo alvo sem retentativas
+    e cai pela metade quando um lote demora demais ou precisou de retentativas.
+    As retentativas observadas são as contadas em `retry_stats` do controlador
+    (ver counting_retries), não as de outras importações do processo.
+    """
+
+    def __init__(self, initial_size, minimum=1, maximum=BATCH_SIZE_ADAPTIVE_MAX,
+                 target_seconds=BATCH_TARGET_SECONDS, enabled=True):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.enabled = enabled
+        self._size = max(minimum, min(maximum, initial_size))
+        self._lock = threading.Lock()
+        self.retry_stats = RetryStats()
+        self._last_retries = 0
+
+    @property
+    def batch_size(self):
+        with self._lock:
+            return self._size
+
+    def next_batch_size(self):
+        return self.batch_size
+
+    def record_batch(self, rows, elapsed):
+        """Registra o tempo de um lote de `rows` linhas e ajusta o próximo tamanho"""
+        retries = self.retry_stats.snapshot()["retries"]
+        with self._lock:
+            new_retries = retries - self._last_retries
+            self._last_retries = retries
+            if not self.enabled or rows == 0:
+                return self._size
+            if new_retries > 0 or elapsed > self.target_seconds * 1.5:
+                self._size = max(self.minimum, self._size // 2)
+            elif elapsed < self.target_seconds and rows >= self._size:
+                self._size = min(self.maximum, max(self._size + 1, int(self._size * 1.25)))
+            return self._size
@@ -0,0 +1,37 @@
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+def batch_job_ids(df_batch):
+    """Ids de job de um lote, usados para não processar o mesmo job em paralelo"""
+    return set(df_batch['ID'].dropna())
+
+def run_batches(batches, process, max_in_flight, batch_keys=batch_job_ids):
+    """Executa `process(batch)` em paralelo, com no máximo `max_in_flight` lotes em andamento.
+
+    Gera (batch, resultado) na ordem em que os lotes terminam. Um lote que
+    compartilha ids com outro ainda em andamento espera ele terminar, assim o
+    mesmo job nunca é gravado por duas threads ao mesmo tempo. Os lotes são
+    consumidos de forma preguiçosa, então só os lotes em andamento ficam em memória.
+    Cada lote roda com o contexto de quem chama (ex.: o escopo de métricas da importação).
+    """
+    max_in_flight = max(1, int(max_in_flight))
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        pending = {}
+        in_flight = set()
+
+        def collect_finished():
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch, keys = pending.pop(future)
+                in_flight.difference_update(keys)
+                yield batch, future.result()
+
+        for batch in batches:
+            keys = batch_keys(batch) if batch_keys else set()
+            while pending and (len(pending) >= max_in_flight or keys & in_flight):
+                yield from collect_finished()
+            pending[executor.submit(contextvars.copy_context().run, process, batch)] = (batch, keys)
+            in_flight.update(keys)
+
+        while pending:
+            yield from collect_finished()
@@ -12,6 +12,77 @@ DATE_FIELDS = [
 BATCH_SIZE_DEFAULT = 10
 BATCH_SIZE_MAX = 100
 
+# Controle adaptativo do tamanho do lote
+BATCH_SIZE_ADAPTIVE_MAX = 1000
+BATCH_TARGET_SECONDS = 2.0  # tempo alvo de processamento de um lote
+
+# Retentativas de falhas transitórias (5xx, timeout, conexão)
+RETRY_ATTEMPTS = 5
+RETRY_WAIT_MULTIPLIER = 0.5  # segundos
+RETRY_WAIT_MAX_SECONDS = 20
+
+# Lotes processados em paralelo
+CONCURRENCY_DEFAULT = 4
+CONCURRENCY_MAX = 16
+
+# Processos que preparam os lotes à frente das threads de gravação (0 = na própria thread),
+# limitado a um a menos que o número de núcleos
+PARSE_WORKERS_DEFAULT = 2
+
+# Pool de clientes Supabase, compartilhado pelas threads de gravação e pelas sessões
+SUPABASE_POOL_SIZE = CONCURRENCY_MAX  # clientes; cada lote em andamento usa um
+SUPABASE_CONNECTIONS_PER_CLIENT = 4
+SUPABASE_KEEPALIVE_SECONDS = 60  # tempo que uma conexão ociosa fica aberta para reuso
+SUPABASE_REQUEST_TIMEOUT_SECONDS = 120
+SUPABASE_CONNECT_TIMEOUT_SECONDS = 10
+
+# Limites das chamadas em lote ao Supabase
+IN_FILTER_CHUNK_SIZE = 150  # ids por filtro in_ (mantém a URL curta)
+UPSERT_CHUNK_SIZE = 500  # linhas por chamada de upsert
+OR_FILTER_MAX_LENGTH = 4000  # caracteres por filtro or_ (a URL passa por gateways com limite ~8 KB)
+
+# Cache de ids das tabelas de referência
+REFERENCE_TABLES = ['company', 'title_taxonomy', 'skill_2_skill_pt_br']
+REFERENCE_CACHE_MAX_SIZE = 200000  # ids por tabela
+
+# Leitura do CSV em pedaços
+CSV_CHUNK_SIZE = 5000  # linhas por pedaço lido do arquivo
+BODY_CHUNK_SIZE = 500  # linhas de BODY lidas por vez; a coluna é lida à parte (ver BodyReader)
+ROW_COUNT_SAMPLE_BYTES = 1024 * 1024  # amostra usada para estimar o total de linhas
+
+# Colunas do arquivo usadas pela importação (projeção na leitura de Parquet/Arrow)
+INPUT_COLUMNS = [
+    'ID', 'LAST_UPDATED_DATE', 'BODY', 'TITLE_RAW', 'URL', 'SOURCES', 'LANGUAGE', 'COMPANY',
+    'COMPANY_NAME', 'EXPIRED', 'POSTED', 'SKILLS', 'SKILLS_NAME', 'TITLE', 'TITLE_NAME',
+    'TITLE_CLEAN', 'NATION', 'OCCUPATION', 'OCCUPATION_NAME', 'SPECIALIZED_SKILLS',
+    'SPECIALIZED_SKILLS_NAME', 'COMMON_SKILLS', 'COMMON_SKILLS_NAME', 'SOFTWARE_SKILLS',
+    'SOFTWARE_SKILLS_NAME', 'CERTIFICATIONS', 'CERTIFICATIONS_NAME', 'REMOTE_TYPE',
+    'MAX_YEARS_EXPERIENCE', 'MIN_YEARS_EXPERIENCE'
+]
+# Texto longo, lido só para os lotes que vão ser gravados (ver BodyReader)
+DEFERRED_COLUMNS = ['BODY']
+
+# Intervalo de atualização do progresso na página (segundos)
+UI_REFRESH_SECONDS = 1.0
+ERRORS_PAGE_SIZE = 50  # linhas por página na tabela de erros
+
+# Importações concluídas que ficam disponíveis na página (cada uma guarda o resultado
+# por linha): só as mais recentes e por um tempo limitado
+FINISHED_IMPORTS_MAX = 5
+FINISHED_IMPORTS_TTL_SECONDS = 6 * 60 * 60
+
+# Modo compacto de leitura: colunas repetitivas como categóricas e inteiros como Int64
+CATEGORY_COLUMNS = [
+    'COMPANY_NAME', 'TITLE', 'TITLE_NAME', 'NATION', 'LANGUAGE', 'REMOTE_TYPE', 'OCCUPATION', 'OCCUPATION_NAME'
+]
+INTEGER_COLUMNS = ['COMPANY', 'MAX_YEARS_EXPERIENCE', 'MIN_YEARS_EXPERIENCE']
+
+# Diretório dos diários de importação (retomada após queda)
+IMPORT_JOURNAL_DIR = '.import_journal'
+
+# Textos de array distintos memoizados pelo parser
+ARRAY_PARSE_CACHE_SIZE = 65536
+
 JOB_FIELDS = [
     'id',
     'last_updated_date',
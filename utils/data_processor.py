@@ -1,124 +1,304 @@
-from .constants import ARRAY_FIELDS, DATE_FIELDS, JOB_FIELDS, NUMERIC_FIELDS
+from .batch_controller import execute_query
+from .instrumentation import pipeline_metrics
+from .constants import ARRAY_FIELDS, ARRAY_PARSE_CACHE_SIZE, DATE_FIELDS, IN_FILTER_CHUNK_SIZE, JOB_FIELDS, NUMERIC_FIELDS, OR_FILTER_MAX_LENGTH, UPSERT_CHUNK_SIZE
 import pandas as pd
+from postgrest import ReturnMethod
 from datetime import datetime
+from functools import lru_cache
 import ast
+import hashlib
+import json
 import logging
+import sys
 
-def prepare_job_data(row):
-    """Prepara os dados do job para inserção no Supabase"""
-    try:
-        # Processar datas
-        last_updated_date = pd.to_datetime(row['LAST_UPDATED_DATE']).strftime('%Y-%m-%d') if pd.notna(row['LAST_UPDATED_DATE']) else None
-        expired = pd.to_datetime(row['EXPIRED']).strftime('%Y-%m-%d') if pd.notna(row['EXPIRED']) else None
-        posted = pd.to_datetime(row['POSTED']).strftime('%Y-%m-%d') if pd.notna(row['POSTED']) else None
-
-        # Processar arrays
-        arrays = {
-            'SOURCES': [],
-            'SKILLS': [],
-            'SPECIALIZED_SKILLS': [],
-            'SPECIALIZED_SKILLS_NAME': [],
-            'COMMON_SKILLS': [],
-            'COMMON_SKILLS_NAME': [],
-            'SOFTWARE_SKILLS': [],
-            'SOFTWARE_SKILLS_NAME': [],
-            'CERTIFICATIONS': [],
-            'CERTIFICATIONS_NAME': []
-        }
+logger = logging.getLogger(__name__)
 
-        for field in arrays.keys():
-            if field in row and pd.notna(row[field]):
-                try:
-                    arrays[field] = ast.literal_eval(row[field])
-                except:
-                    arrays[field] = []
+def chunked(items, size):
+    """Divide uma lista em pedaços de no máximo `size` itens"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
-        # Processar campos numéricos
+@lru_cache(maxsize=ARRAY_PARSE_CACHE_SIZE)
+def _parse_array_text(text):
+    """Converte o texto de um array em tupla; memoizado porque as mesmas listas se repetem muito"""
+    try:
+        # O Snowflake exporta arrays como JSON (["a", "b"]), bem mais rápido que literal_eval
+        values = json.loads(text)
+    except ValueError:
         try:
-            company = int(row['COMPANY']) if pd.notna(row['COMPANY']) and row['COMPANY'] != '0' and row['COMPANY'] != '' else None
-        except:
-            company = None
+            values = ast.literal_eval(text)
+        except Exception:
+            return ()
+    if not isinstance(values, list):
+        return ()
+    return tuple(sys.intern(value) if isinstance(value, str) else value for value in values)
 
-        try:
-            max_years = int(float(row['MAX_YEARS_EXPERIENCE'])) if pd.notna(row['MAX_YEARS_EXPERIENCE']) else None
-            min_years = int(float(row['MIN_YEARS_EXPERIENCE'])) if pd.notna(row['MIN_YEARS_EXPERIENCE']) else None
-        except:
-            max_years = None
-            min_years = None
-
-        # Montar dados do job
-        job_data = {
-            "id": row['ID'],
-            "last_updated_date": last_updated_date,
-            "body": row['BODY'] if pd.notna(row['BODY']) else None,
-            "title_raw": row['TITLE_RAW'] if pd.notna(row['TITLE_RAW']) else None,
-            "url": row['URL'] if pd.notna(row['URL']) else None,
-            "sources": arrays['SOURCES'],
-            "language": row['LANGUAGE'] if pd.notna(row['LANGUAGE']) else None,
-            "company": company,
-            "expired": expired,
-            "posted": posted,
-            "skills": arrays['SKILLS'],
-            "title": row['TITLE'] if pd.notna(row['TITLE']) else None,
-            "title_name": row['TITLE_NAME'] if pd.notna(row['TITLE_NAME']) else None,
-            "title_clean": row['TITLE_CLEAN'] if pd.notna(row['TITLE_CLEAN']) else None,
-            "nation": row['NATION'] if pd.notna(row['NATION']) else None,
-            "occupation": row['OCCUPATION'] if pd.notna(row['OCCUPATION']) else None,
-            "occupation_name": row['OCCUPATION_NAME'] if pd.notna(row['OCCUPATION_NAME']) else None,
-            "specialized_skills": arrays['SPECIALIZED_SKILLS'],
-            "specialized_skills_name": arrays['SPECIALIZED_SKILLS_NAME'],
-            "common_skills": arrays['COMMON_SKILLS'],
-            "common_skills_name": arrays['COMMON_SKILLS_NAME'],
-            "software_skills": arrays['SOFTWARE_SKILLS'],
-            "software_skills_name": arrays['SOFTWARE_SKILLS_NAME'],
-            "certifications": arrays['CERTIFICATIONS'],
-            "certifications_name": arrays['CERTIFICATIONS_NAME'],
-            "remote_type": row['REMOTE_TYPE'] if pd.notna(row['REMOTE_TYPE']) else None,
-            "max_years_experience": max_years,
-            "min_years_experience": min_years,
-            "last_update_import": datetime.now().isoformat()
-        }
+def parse_array(value):
+    """Converte o literal de array do Snowflake em lista (vazia se nulo ou inválido)
 
-        # Remover campos None ou vazios
-        return {k: v for k, v in job_data.items() if v is not None and v != ''}
+    Colunas de lista lidas de Parquet/Arrow já chegam como listas e são usadas direto.
+    """
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    if not isinstance(value, str):
+        return []
+    return list(_parse_array_text(value))
 
-    except Exception as e:
-        raise Exception(f"Erro ao preparar dados do job: {str(e)}")
+def named_skills(row, skills=None):
+    """Pares (id, nome) das skills do job: SKILLS alinhado com SKILLS_NAME, sem ids nulos.
+
+    Só as skills com nome são criadas e vinculadas em job_skill, nos três modos
+    de gravação (REST, RPC e carga direta). `skills` é o array SKILLS já
+    convertido, quando quem chama já o tem.
+    """
+    if skills is None:
+        skills = parse_array(row.get('SKILLS'))
+    return [
+        (skill_id, skill_name)
+        for skill_id, skill_name in zip(skills, parse_array(row.get('SKILLS_NAME')))
+        if skill_id is not None
+    ]
+
+def _parse_date_column(column):
+    """Converte uma coluna de datas em strings YYYY-MM-DD e aponta os valores inválidos"""
+    present = column.notna()
+    try:
+        parsed = pd.to_datetime(column, errors='coerce', format='mixed')
+        dates = parsed.dt.strftime('%Y-%m-%d')
+    except (ValueError, TypeError, AttributeError):
+        # Fusos horários misturados: cai para a conversão valor a valor
+        def parse_scalar(value):
+            try:
+                return pd.to_datetime(value).strftime('%Y-%m-%d')
+            except Exception:
+                return None
+        dates = column.map(parse_scalar, na_action='ignore')
+    invalid = present & dates.isna()
+    return dates.astype(object).where(dates.notna(), None), invalid
+
+def _parse_integer_columns(columns):
+    """Converte colunas numéricas em inteiros; se uma delas for inválida, todas viram None na linha"""
+    values = {}
+    invalid = None
+    for name, column in columns.items():
+        numbers = pd.to_numeric(column, errors='coerce')
+        bad = (column.notna() & numbers.isna()) | numbers.isin([float('inf'), float('-inf')])
+        invalid = bad if invalid is None else invalid | bad
+        values[name] = numbers
+    result = {}
+    for name, numbers in values.items():
+        numbers = numbers.where(~invalid & numbers.notna())
+        result[name] = [None if pd.isna(v) else int(v) for v in numbers]
+    return result
+
+def prepare_jobs_frame(df):
+    """Prepara todos os jobs de um DataFrame de uma vez, coluna a coluna.
+
+    Retorna (jobs, errors), duas listas alinhadas com as linhas de `df`: o
+    payload do job (ou None) e a mensagem de erro da linha (ou None).
+    """
+    n_rows = len(df)
+    errors = [None] * n_rows
+    columns = {}
+
+    def column(name):
+        if name not in df.columns:
+            return pd.Series([None] * n_rows, index=df.index, dtype=object)
+        return df[name]
+
+    # ID: sem ele o job não pode ser gravado (upsert por id, job_skill)
+    ids = column('ID')
+    missing_id = ids.isna() | (ids.astype(str).str.strip() == '')
+    for position in missing_id.to_numpy().nonzero()[0]:
+        errors[position] = "Erro ao preparar dados do job: ID vazio"
+
+    # Campos de texto: nulos viram None
+    for field in JOB_FIELDS:
+        if field in ARRAY_FIELDS or field in DATE_FIELDS or field in NUMERIC_FIELDS or field == 'company':
+            continue
+        values = column(field.upper())
+        columns[field] = values.astype(object).where(values.notna(), None).tolist()
+
+    # Datas
+    for field in DATE_FIELDS:
+        dates, invalid = _parse_date_column(column(field.upper()))
+        columns[field] = dates.tolist()
+        for position in invalid.to_numpy().nonzero()[0]:
+            if errors[position] is None:
+                value = column(field.upper()).iloc[position]
+                errors[position] = f"Erro ao preparar dados do job: data inválida em {field.upper()}: {value!r}"
+
+    # Arrays
+    with pipeline_metrics.stage('array_parsing'):
+        for field in ARRAY_FIELDS:
+            if field in JOB_FIELDS:
+                columns[field] = [parse_array(value) for value in column(field.upper())]
+
+    # Company: apenas inteiros diferentes de zero
+    companies = column('COMPANY')
+    integer_like = companies.astype(str).str.fullmatch(r'\s*[+-]?\d+\s*') & companies.notna()
+    company_numbers = pd.to_numeric(companies.where(integer_like), errors='coerce')
+    columns['company'] = [None if pd.isna(v) or v == 0 else int(v) for v in company_numbers]
+
+    # Anos de experiência
+    columns.update(_parse_integer_columns({field: column(field.upper()) for field in NUMERIC_FIELDS}))
+
+    # Monta os payloads numa única passada, removendo campos None ou vazios
+    last_update_import = datetime.now().isoformat()
+    jobs = []
+    for position in range(n_rows):
+        if errors[position] is not None:
+            jobs.append(None)
+            continue
+        job_data = {field: columns[field][position] for field in JOB_FIELDS}
+        job_data["last_update_import"] = last_update_import
+        jobs.append({k: v for k, v in job_data.items() if v is not None and v != ''})
 
-def process_skills(row, supabase):
-    """Processa as skills do job"""
+    return jobs, errors
+
+def job_fingerprint(job_data):
+    """Hash estável do conteúdo do job (sem o carimbo da importação)"""
+    content = {k: v for k, v in job_data.items() if k not in ('last_update_import', 'import_fingerprint')}
+    encoded = json.dumps(content, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.blake2b(encoded.encode('utf-8'), digest_size=16).hexdigest()
+
+def is_unchanged(job_data, stored):
+    """Compara o job preparado com a linha já gravada (id, import_fingerprint, last_updated_date).
+
+    Linhas gravadas antes da coluna import_fingerprint existir são comparadas pela
+    last_updated_date.
+    """
+    if not stored:
+        return False
+    if stored.get('import_fingerprint'):
+        return stored['import_fingerprint'] == job_data.get('import_fingerprint')
+    return bool(stored.get('last_updated_date')) and stored['last_updated_date'] == job_data.get('last_updated_date')
+
+def process_skills(row, supabase, reference_cache=None):
+    """Processa as skills do job
+
+    Com `reference_cache`, as skills já garantidas pelo prefetch do lote não são consultadas de novo.
+    """
     try:
-        skills = ast.literal_eval(row['SKILLS']) if pd.notna(row['SKILLS']) else []
-        skills_name = ast.literal_eval(row['SKILLS_NAME']) if pd.notna(row['SKILLS_NAME']) else []
+        skills = parse_array(row['SKILLS'])
+        skills_name = parse_array(row['SKILLS_NAME'])
         
         # Limpa skills existentes do job
-        supabase.table('job_skill').delete().eq('job', row['ID']).execute()
+        execute_query(supabase.table('job_skill').delete(returning=ReturnMethod.minimal).eq('job', row['ID']), 'job_skill', 'delete')
         
         for skill_id, skill_name in zip(skills, skills_name):
             try:
-                # Verifica se skill existe
-                skill_exists = supabase.table('skill_2_skill_pt_br').select('*').eq('id', skill_id).execute()
+                # Verifica se skill existe (dispensado quando já está no cache)
+                skill_known = reference_cache is not None and reference_cache.contains('skill_2_skill_pt_br', skill_id)
+                skill_exists = None if skill_known else execute_query(supabase.table('skill_2_skill_pt_br').select('*').eq('id', skill_id), 'skill_2_skill_pt_br', 'select')
                 
-                if not skill_exists.data:
+                if not skill_known and not skill_exists.data:
                     # Cria nova skill
                     skill_data = {
                         "id": skill_id,
                         "name": skill_name,
                         "latest_version": True
                     }
-                    supabase.table('skill_2_skill_pt_br').insert(skill_data).execute()
-                    print(f"Nova skill criada: {skill_id} - {skill_name}")
+                    execute_query(supabase.table('skill_2_skill_pt_br').insert(skill_data, returning=ReturnMethod.minimal), 'skill_2_skill_pt_br', 'insert', idempotent=False)
+                    logger.debug(f"Nova skill criada: {skill_id} - {skill_name}")
 
                 # Vincula skill ao job
                 job_skill_data = {
                     "job": row['ID'],
                     "skill": skill_id
                 }
-                supabase.table('job_skill').insert(job_skill_data).execute()
+                execute_query(supabase.table('job_skill').insert(job_skill_data, returning=ReturnMethod.minimal), 'job_skill', 'insert', idempotent=False)
                 
             except Exception as e:
-                print(f"Erro ao processar skill {skill_id}: {str(e)}")
+                logger.warning(f"Erro ao processar skill {skill_id}: {str(e)}")
                 
     except Exception as e:
-        print(f"Erro ao processar skills: {str(e)}")
-        raise
\ No newline at end of file
+        logger.debug(f"Erro ao processar skills: {str(e)}")
+        raise
+
+def _postgrest_quote(value):
+    """Coloca um valor entre aspas para uso nos filtros or_ do PostgREST"""
+    escaped = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{escaped}"'
+
+def _skill_delete_filters(to_delete, max_length=OR_FILTER_MAX_LENGTH):
+    """Filtros or_ que removem os vínculos de `to_delete` ({job: skills}), cada um com até `max_length` caracteres
+
+    Os pares (job, skill) são agrupados pelo tamanho do filtro e não pela
+    quantidade de jobs; um job com muitas skills obsoletas é dividido em mais
+    de um termo.
+    """
+    terms = []
+    for job_id, skills in to_delete.items():
+        prefix = f"and(job.eq.{_postgrest_quote(job_id)},skill.in.("
+        quoted = []
+        length = len(prefix) + 2
+        for skill in sorted(skills):
+            skill = _postgrest_quote(skill)
+            if quoted and length + len(skill) + 1 > max_length:
+                terms.append(f"{prefix}{','.join(quoted)}))")
+                quoted, length = [], len(prefix) + 2
+            quoted.append(skill)
+            length += len(skill) + 1
+        terms.append(f"{prefix}{','.join(quoted)}))")
+
+    condition = []
+    length = 0
+    for term in terms:
+        if condition and length + len(term) + 1 > max_length:
+            yield ','.join(condition)
+            condition, length = [], 0
+        condition.append(term)
+        length += len(term) + 1
+    if condition:
+        yield ','.join(condition)
+
+def sync_job_skills(jobs, supabase, skills=None):
+    """Sincroniza job_skill de um lote de jobs aplicando só a diferença.
+
+    Recebe os payloads já preparados e, em `skills` (listas alinhadas com
+    `jobs`), as skills a vincular; sem elas, o array `skills` de cada job.
+    Carrega os vínculos atuais de todos os jobs do lote numa consulta, compara
+    com as skills desejadas e faz um delete e um insert em lote apenas
+    com os vínculos que mudaram. As skills precisam já existir em
+    skill_2_skill_pt_br (ver ReferenceCache.prefetch).
+    """
+    try:
+        # A última ocorrência de cada job no lote é a que vale
+        desired = {}
+        for position, job_data in enumerate(jobs):
+            desired[job_data['id']] = set(skills[position] if skills is not None else job_data.get('skills', []))
+
+        existing = {job_id: set() for job_id in desired}
+        for chunk in chunked(list(desired), IN_FILTER_CHUNK_SIZE):
+            result = execute_query(supabase.table('job_skill').select('job, skill').in_('job', chunk), 'job_skill', 'select')
+            for link in result.data:
+                if link['skill'] is not None:
+                    existing[link['job']].add(link['skill'])
+
+        to_delete = {
+            job_id: existing[job_id] - skills
+            for job_id, skills in desired.items()
+            if existing[job_id] - skills
+        }
+        to_insert = [
+            {"job": job_id, "skill": skill_id}
+            for job_id, skills in desired.items()
+            for skill_id in sorted(skills - existing[job_id])
+        ]
+
+        # Um filtro or_ remove os vínculos obsoletos de vários jobs de uma vez
+        for condition in _skill_delete_filters(to_delete):
+            execute_query(supabase.table('job_skill').delete(returning=ReturnMethod.minimal).or_(condition), 'job_skill', 'delete')
+
+        for chunk in chunked(to_insert, UPSERT_CHUNK_SIZE):
+            # Insert simples não é idempotente: só repete se a conexão nem foi aberta
+            execute_query(supabase.table('job_skill').insert(chunk, returning=ReturnMethod.minimal), 'job_skill', 'insert', idempotent=False)
+
+        return {
+            "inserted": len(to_insert),
+            "deleted": sum(len(skills) for skills in to_delete.values())
+        }
+
+    except Exception as e:
+        raise Exception(f"Erro ao sincronizar skills: {str(e)}")
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+from utils.file_loader import iter_chunks
+from utils.instrumentation import pipeline_metrics
+
+def _compact_keys(chunk):
+    """(hash do ID, data em microssegundos, posição) das linhas do pedaço com ID"""
+    ids = chunk['ID']
+    present = ids.notna().to_numpy()
+    if 'LAST_UPDATED_DATE' in chunk.columns:
+        dates = pd.to_datetime(chunk['LAST_UPDATED_DATE'], errors='coerce', utc=True, format='mixed')
+        # NaT vira o menor int64: datas vazias ou inválidas ficam como as mais antigas
+        dates = dates.dt.tz_convert(None).dt.as_unit('us').to_numpy().view(np.int64)
+    else:
+        dates = np.full(len(chunk), np.iinfo(np.int64).min, dtype=np.int64)
+    positions = chunk.index.to_numpy()
+    if len(positions) and positions.max() <= np.iinfo(np.int32).max:
+        positions = positions.astype(np.int32)
+    return (
+        pd.util.hash_array(ids.to_numpy(dtype=object)[present]),
+        dates[present],
+        positions[present],
+    )
+
+def find_superseded_rows(source):
+    """Índices das linhas substituídas por uma versão mais nova do mesmo ID no arquivo.
+
+    Lê só ID e LAST_UPDATED_DATE do arquivo inteiro. Para cada ID fica a linha
+    com a LAST_UPDATED_DATE mais recente; datas vazias ou inválidas contam como
+    as mais antigas e, no empate, vale a última ocorrência no arquivo. Retorna
+    um array ordenado com os índices (os mesmos de iter_chunks) das demais.
+
+    O índice guarda só arrays numpy, cerca de 20 bytes por linha: o ID vira um
+    hash de 64 bits (uma colisão entre IDs diferentes é improvável mesmo com
+    centenas de milhões de linhas), a data um int64 e a posição um int32.
+    """
+    with pipeline_metrics.stage('deduplication'):
+        hashes, dates, positions = [], [], []
+        for chunk in iter_chunks(source, columns=['ID', 'LAST_UPDATED_DATE']):
+            if 'ID' not in chunk.columns:
+                return np.array([], dtype=np.int64)
+            chunk_hashes, chunk_dates, chunk_positions = _compact_keys(chunk)
+            hashes.append(chunk_hashes)
+            dates.append(chunk_dates)
+            positions.append(chunk_positions)
+        if not hashes:
+            return np.array([], dtype=np.int64)
+
+        hashes = np.concatenate(hashes)
+        dates = np.concatenate(dates)
+        positions = np.concatenate(positions)
+        # Ordenado por ID, data e posição, a última linha de cada ID é a que fica
+        order = np.lexsort((positions, dates, hashes))
+        hashes = hashes[order]
+        superseded = positions[order][:-1][hashes[:-1] == hashes[1:]]
+        return np.sort(superseded.astype(np.int64))
+
+def drop_superseded(chunk, superseded):
+    """Remove de um pedaço do arquivo as linhas substituídas (ver find_superseded_rows)"""
+    if len(superseded) == 0:
+        return chunk
+    return chunk[~chunk.index.isin(superseded)]
@@ -0,0 +1,312 @@
+import csv
+import gzip
+import io
+import os
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from utils.constants import (
+    BODY_CHUNK_SIZE,
+    CATEGORY_COLUMNS,
+    CSV_CHUNK_SIZE,
+    DEFERRED_COLUMNS,
+    INPUT_COLUMNS,
+    INTEGER_COLUMNS,
+    ROW_COUNT_SAMPLE_BYTES,
+)
+
+# Texto livre no modo compacto: guardado em buffers do Arrow, sem um objeto Python por valor
+COMPACT_STRING_DTYPE = pd.StringDtype('pyarrow')
+
+def _rewind(source):
+    """Volta o arquivo para o início (uploads do Streamlit são lidos mais de uma vez)"""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+def file_size(source):
+    """Tamanho em bytes de um caminho ou de um arquivo aberto"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    if getattr(source, 'size', None) is not None:
+        return source.size
+    position = source.tell()
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    source.seek(position)
+    return size
+
+def _source_name(source):
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source).lower()
+    return (getattr(source, 'name', None) or '').lower()
+
+def file_format(source):
+    """Identifica o formato do arquivo: 'parquet', 'arrow', 'arrow_stream', 'csv_gzip' ou 'csv'
+
+    Usa a assinatura dos primeiros bytes e, para o formato de stream do Arrow
+    (que não tem assinatura), a extensão `.arrows`.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            magic = f.read(6)
+    else:
+        _rewind(source)
+        magic = source.read(6)
+        _rewind(source)
+    if magic[:4] == b'PAR1':
+        return 'parquet'
+    if magic == b'ARROW1':
+        return 'arrow'
+    if magic[:2] == b'\x1f\x8b':
+        return 'csv_gzip'
+    if _source_name(source).endswith('.arrows'):
+        return 'arrow_stream'
+    return 'csv'
+
+def _arrow_buffer(source):
+    """Buffer do arquivo sem cópia: mapeado em memória para caminhos, a memória do upload para arquivos abertos"""
+    if isinstance(source, (str, os.PathLike)):
+        return pa.memory_map(os.fspath(source), 'r')
+    if hasattr(source, 'getbuffer'):
+        return pa.BufferReader(pa.py_buffer(source.getbuffer()))
+    _rewind(source)
+    return pa.BufferReader(source.read())
+
+def _projected(names, columns=None):
+    """Colunas do arquivo usadas pela importação (ou as pedidas), na ordem do arquivo"""
+    wanted = set(INPUT_COLUMNS if columns is None else columns)
+    return [name for name in names if name in wanted]
+
+def _compact_integers(frame):
+    """Converte as colunas inteiras para Int64 quando todos os valores são inteiros.
+
+    Se a coluna tiver algum valor inválido ela fica como texto, para que
+    prepare_jobs_frame aponte o erro na linha certa.
+    """
+    for name in INTEGER_COLUMNS:
+        if name not in frame.columns or frame[name].dtype == 'Int64':
+            continue
+        values = frame[name].dropna().astype(str)
+        if not values.str.fullmatch(r'\s*[+-]?\d+\s*').all():
+            continue
+        try:
+            frame[name] = pd.to_numeric(frame[name]).astype('Int64')
+        except (ValueError, TypeError, OverflowError):
+            pass
+    return frame
+
+def _batch_to_frame(batch, start, compact=True):
+    """Converte um RecordBatch no mesmo formato do pedaço lido do CSV.
+
+    Colunas de lista viram listas Python (sem passar por texto); as demais
+    viram texto, como se tivessem vindo do CSV. No modo compacto o texto fica
+    nos buffers do Arrow e as colunas repetitivas viram categóricas.
+    """
+    data = {}
+    for name, column in zip(batch.schema.names, batch.columns):
+        if pa.types.is_list(column.type) or pa.types.is_large_list(column.type):
+            data[name] = pd.Series(column.to_pylist(), dtype=object)
+            continue
+        if not pa.types.is_string(column.type) and not pa.types.is_large_string(column.type):
+            column = column.cast(pa.string())
+        if not compact:
+            data[name] = column.to_pandas()
+        elif name in CATEGORY_COLUMNS:
+            data[name] = column.dictionary_encode().to_pandas()
+        else:
+            data[name] = pd.Series(pd.arrays.ArrowStringArray(pa.chunked_array([column])))
+    frame = pd.DataFrame(data)
+    frame.index = pd.RangeIndex(start, start + batch.num_rows)
+    return _compact_integers(frame) if compact else frame
+
+def _iter_record_batches(source, chunksize, columns=None):
+    """Lê Parquet ou Arrow IPC em RecordBatches de até `chunksize` linhas, só com as colunas usadas (ou as pedidas)"""
+    fmt = file_format(source)
+    if fmt == 'parquet':
+        if isinstance(source, (str, os.PathLike)):
+            parquet = pq.ParquetFile(os.fspath(source), memory_map=True)
+        else:
+            parquet = pq.ParquetFile(_arrow_buffer(source))
+        names = _projected(parquet.schema_arrow.names, columns)
+        yield from parquet.iter_batches(batch_size=chunksize, columns=names)
+        return
+
+    reader = ipc.open_file(_arrow_buffer(source)) if fmt == 'arrow' else ipc.open_stream(_arrow_buffer(source))
+    names = _projected(reader.schema.names, columns)
+    batches = (
+        (reader.get_batch(i) for i in range(reader.num_record_batches)) if fmt == 'arrow' else reader
+    )
+    for batch in batches:
+        batch = batch.select(names)
+        for offset in range(0, batch.num_rows, chunksize):
+            yield batch.slice(offset, chunksize)
+
+def _csv_dtypes(compact):
+    if not compact:
+        return str
+    return defaultdict(lambda: COMPACT_STRING_DTYPE, {name: 'category' for name in CATEGORY_COLUMNS})
+
+def iter_csv_chunks(source, chunksize=CSV_CHUNK_SIZE, compression='infer', compact=False, columns=None):
+    """Lê o CSV em pedaços de `chunksize` linhas, com memória constante.
+
+    O índice das linhas é contínuo entre os pedaços, então `index + 1` continua
+    sendo o número da linha no arquivo. Com `compact`, o texto fica em
+    buffers do Arrow, as colunas repetitivas viram categóricas e as inteiras Int64.
+    Com `columns`, só essas colunas são lidas.
+    """
+    _rewind(source)
+    usecols = (lambda name: name in columns) if columns is not None else None
+    with pd.read_csv(source, dtype=_csv_dtypes(compact), chunksize=chunksize, compression=compression,
+                     usecols=usecols) as reader:
+        for chunk in reader:
+            yield _compact_integers(chunk) if compact else chunk
+
+def iter_chunks(source, chunksize=CSV_CHUNK_SIZE, compact=True, columns=None):
+    """Lê o arquivo (CSV, CSV gzip, Parquet ou Arrow IPC) em pedaços de `chunksize` linhas.
+
+    Parquet e Arrow são lidos só com as colunas usadas na importação e as
+    colunas de lista chegam como listas Python. O índice é contínuo entre os
+    pedaços em todos os formatos. `compact` reduz a memória de cada pedaço
+    (ver iter_csv_chunks); `columns` limita a leitura a essas colunas.
+    """
+    fmt = file_format(source)
+    if fmt in ('csv', 'csv_gzip'):
+        yield from iter_csv_chunks(source, chunksize, 'gzip' if fmt == 'csv_gzip' else None, compact, columns)
+        return
+    start = 0
+    for batch in _iter_record_batches(source, chunksize, columns):
+        yield _batch_to_frame(batch, start, compact)
+        start += batch.num_rows
+
+def can_defer_body(source):
+    """Indica se BODY pode ser lido à parte (ver BodyReader).
+
+    Precisa de uma segunda leitura independente do arquivo: vale para caminhos
+    e para Parquet/Arrow em memória, mas não para um CSV aberto, em que as duas
+    leituras dividiriam a mesma posição.
+    """
+    return isinstance(source, (str, os.PathLike)) or file_format(source) not in ('csv', 'csv_gzip')
+
+class BodyReader:
+    """Lê a coluna BODY à parte, em ordem, entregando só a das linhas pedidas.
+
+    BODY é a maior coluna do arquivo; lida com os pedaços, ela ficaria na
+    memória por CSV_CHUNK_SIZE linhas enquanto os lotes são preparados. Aqui
+    ela é lida em pedaços de `chunksize` linhas só quando um lote é montado,
+    e o texto das linhas puladas (diário, duplicados) é descartado. Os índices
+    pedidos em `take` precisam ser crescentes entre as chamadas.
+    """
+
+    def __init__(self, source, chunksize=BODY_CHUNK_SIZE):
+        self._chunks = iter_chunks(source, chunksize, columns=DEFERRED_COLUMNS)
+        self._current = None
+        self._exhausted = False
+
+    def _advance(self):
+        chunk = next(self._chunks, None)
+        if chunk is None or 'BODY' not in chunk.columns:
+            # Fim do arquivo, ou arquivo sem BODY: as linhas restantes ficam sem texto
+            self._exhausted = True
+            self._current = None
+        else:
+            self._current = chunk['BODY']
+
+    def take(self, index):
+        """BODY das linhas `index` (índices do arquivo, em ordem), alinhado com elas"""
+        index = np.asarray(index, dtype=np.int64)
+        values = np.full(len(index), None, dtype=object)
+        done = 0
+        while done < len(index) and not self._exhausted:
+            if self._current is None or len(self._current) == 0 or self._current.index[-1] < index[done]:
+                self._advance()
+                continue
+            start = self._current.index[0]
+            end = done + np.searchsorted(index[done:], self._current.index[-1], side='right')
+            values[done:end] = self._current.iloc[index[done:end] - start].to_numpy(dtype=object)
+            done = end
+        return pd.Series(values, index=index, dtype=COMPACT_STRING_DTYPE)
+
+def read_csv_preview(source, rows=5, compression=None):
+    """Lê só as primeiras linhas do CSV para o preview"""
+    _rewind(source)
+    preview = pd.read_csv(source, dtype=str, nrows=rows, compression=compression)
+    _rewind(source)
+    return preview
+
+def read_preview(source, rows=5):
+    """Primeiras linhas do arquivo, em qualquer formato suportado, para o preview"""
+    fmt = file_format(source)
+    if fmt in ('csv', 'csv_gzip'):
+        return read_csv_preview(source, rows, 'gzip' if fmt == 'csv_gzip' else None)
+    for batch in _iter_record_batches(source, rows):
+        return _batch_to_frame(batch, 0, compact=False)
+    return pd.DataFrame()
+
+def _gzip_size(source):
+    """Tamanho descompactado do gzip, gravado (módulo 2**32) nos últimos 4 bytes"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            f.seek(-4, os.SEEK_END)
+            trailer = f.read(4)
+    else:
+        position = source.tell()
+        source.seek(-4, os.SEEK_END)
+        trailer = source.read(4)
+        source.seek(position)
+    return int.from_bytes(trailer, 'little')
+
+def estimate_rows(source):
+    """Número de registros do arquivo: exato para Parquet e Arrow, estimado para CSV"""
+    fmt = file_format(source)
+    if fmt == 'parquet':
+        if isinstance(source, (str, os.PathLike)):
+            return pq.ParquetFile(os.fspath(source), memory_map=True).metadata.num_rows
+        return pq.ParquetFile(_arrow_buffer(source)).metadata.num_rows
+    if fmt == 'arrow':
+        reader = ipc.open_file(_arrow_buffer(source))
+        return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+    if fmt == 'arrow_stream':
+        return sum(batch.num_rows for batch in _iter_record_batches(source, CSV_CHUNK_SIZE, columns=[]))
+    if fmt == 'csv_gzip':
+        return estimate_csv_rows(source, compression='gzip')
+    return estimate_csv_rows(source)
+
+def estimate_csv_rows(source, sample_bytes=ROW_COUNT_SAMPLE_BYTES, compression=None):
+    """Estima o número de registros do CSV a partir de uma amostra do início.
+
+    Conta os registros (não as linhas físicas, já que BODY tem quebras de linha)
+    da amostra e extrapola pelo tamanho do arquivo. Se o arquivo couber na
+    amostra, a contagem é exata.
+    """
+    if compression == 'gzip':
+        # Amostra e tamanho do conteúdo descompactado
+        size = _gzip_size(source)
+        _rewind(source)
+        with gzip.open(source, 'rb') as f:
+            sample = f.read(sample_bytes)
+        _rewind(source)
+    elif isinstance(source, (str, os.PathLike)):
+        size = file_size(source)
+        with open(source, 'rb') as f:
+            sample = f.read(sample_bytes)
+    else:
+        size = file_size(source)
+        _rewind(source)
+        sample = source.read(sample_bytes)
+        _rewind(source)
+    if not sample:
+        return 0
+
+    text = sample.decode('utf-8-sig', errors='ignore') if isinstance(sample, bytes) else sample
+    records = sum(1 for record in csv.reader(io.StringIO(text)) if record) - 1  # sem o cabeçalho
+    if len(sample) >= size:
+        return max(records, 0)
+
+    # O último registro da amostra provavelmente está cortado
+    records = max(records - 1, 1)
+    return int(size * records / len(sample))
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from utils.constants import IMPORT_JOURNAL_DIR
+
+def file_hash(source, block_size=1024 * 1024):
+    """SHA-256 do conteúdo de um caminho ou arquivo aberto, lido em blocos"""
+    digest = hashlib.sha256()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+    else:
+        source.seek(0)
+        for block in iter(lambda: source.read(block_size), b''):
+            digest.update(block)
+        source.seek(0)
+    return digest.hexdigest()
+
+def index_ranges(index):
+    """Compacta os índices de um lote em intervalos [início, fim)"""
+    values = np.sort(np.asarray(index, dtype=np.int64))
+    if len(values) == 0:
+        return []
+    breaks = np.nonzero(np.diff(values) != 1)[0]
+    starts = np.concatenate(([values[0]], values[breaks + 1]))
+    ends = np.concatenate((values[breaks] + 1, [values[-1] + 1]))
+    return [[int(start), int(end)] for start, end in zip(starts, ends)]
+
+class ImportJournal:
+    """Diário de uma importação, guardado em disco e identificado pelo hash do arquivo.
+
+    Cada lote concluído acrescenta uma linha JSON com as linhas gravadas (ou
+    inalteradas) e as métricas delas. As linhas com erro não entram no diário:
+    ao reabrir o mesmo arquivo, as linhas já gravadas são puladas, as com erro
+    (inclusive as que esgotaram as retentativas numa queda do Supabase) são
+    repetidas e as métricas anteriores são somadas às novas.
+    """
+
+    def __init__(self, content_hash, directory=None):
+        self.content_hash = content_hash
+        self.directory = directory or os.getenv("IMPORT_JOURNAL_DIR", IMPORT_JOURNAL_DIR)
+        self.path = os.path.join(self.directory, f"{content_hash}.jsonl")
+        self.ranges = []
+        self.stats = {}
+        self.complete = False
+        self._lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def for_file(cls, source, directory=None):
+        return cls(file_hash(source), directory)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Última linha cortada por uma queda no meio da escrita
+                    continue
+                if entry.get("complete"):
+                    self.complete = True
+                    continue
+                self.ranges.extend(entry["ranges"])
+                for key, value in entry["stats"].items():
+                    self.stats[key] = self.stats.get(key, 0) + value
+        self._merge_ranges()
+
+    def _merge_ranges(self):
+        merged = []
+        for start, end in sorted(self.ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.ranges = merged
+
+    @property
+    def rows_done(self):
+        return sum(end - start for start, end in self.ranges)
+
+    def filter_pending(self, chunk):
+        """Remove de um pedaço do arquivo as linhas já gravadas numa execução anterior"""
+        if not self.ranges:
+            return chunk
+        starts = np.array([start for start, _ in self.ranges])
+        ends = np.array([end for _, end in self.ranges])
+        index = chunk.index.to_numpy()
+        position = np.searchsorted(starts, index, side='right') - 1
+        done = (position >= 0) & (index < ends[np.maximum(position, 0)])
+        return chunk[~done]
+
+    def record_batch(self, index, batch_stats, failed=()):
+        """Registra um lote concluído (chamado depois que o lote foi gravado)
+
+        `failed` são os índices das linhas com erro, que ficam pendentes; os
+        erros também não entram nas métricas, já que serão contados de novo.
+        """
+        done = np.setdiff1d(np.asarray(index, dtype=np.int64), np.asarray(failed, dtype=np.int64))
+        entry = {
+            "ranges": index_ranges(done),
+            "stats": {key: value for key, value in batch_stats.items() if key not in ("total", "erros")},
+        }
+        self._append(entry)
+        self.ranges.extend(entry["ranges"])
+        self._merge_ranges()
+
+    def mark_complete(self):
+        self._append({"complete": True})
+        self.complete = True
+
+    def reset(self):
+        """Descarta o diário para reimportar o arquivo do zero"""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        self.ranges, self.stats, self.complete = [], {}, False
+
+    def merge_into(self, stats):
+        """Soma as métricas das execuções anteriores em `stats`"""
+        for key, value in self.stats.items():
+            stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def _append(self, entry):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
@@ -0,0 +1,222 @@
+import logging
+import os
+import threading
+import time
+
+from utils.batch_controller import RetryStats, counting_retries
+from utils.constants import FINISHED_IMPORTS_MAX, FINISHED_IMPORTS_TTL_SECONDS
+from utils.importer import run_import
+from utils.instrumentation import pipeline_metrics
+from utils.outcome_ledger import OutcomeLedger
+from utils.postgres_loader import run_bulk_load
+from utils.supabase_handler import SupabaseClientPool, borrow_client
+
+logger = logging.getLogger(__name__)
+
+class ImportStatus:
+    """Estado de uma importação em segundo plano.
+
+    Escrito pela thread da importação e lido por qualquer sessão que a
+    acompanhe; a página lê `snapshot()` no seu próprio ritmo, sem depender
+    de quantos lotes já terminaram. O resultado de cada linha, inclusive os
+    erros, fica em `ledger`.
+    """
+
+    def __init__(self, import_id, file_name, loader, stats):
+        self.import_id = import_id
+        self.file_name = file_name
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._stats = dict(stats)
+        self.ledger = OutcomeLedger()
+        self._state = 'running'
+        self._rows_read = 0
+        self._batch_size = None
+        self._retries = {"retries": 0, "gave_up": 0}
+        self._failure = None
+        self._report = None
+        self._cancel = threading.Event()
+        self._started = time.perf_counter()
+        self._elapsed = None
+        self._finished_at = None
+
+    @property
+    def running(self):
+        with self._lock:
+            return self._state == 'running'
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def finished_at(self):
+        """Instante (time.perf_counter) em que a importação terminou, ou None se ainda roda"""
+        with self._lock:
+            return self._finished_at
+
+    def update(self, stats, rows_read, batch_size=None, retries=None):
+        with self._lock:
+            self._stats = dict(stats)
+            self._rows_read = rows_read
+            if batch_size is not None:
+                self._batch_size = batch_size
+            if retries is not None:
+                self._retries = retries
+
+    def finish(self, state, failure=None, report=None):
+        with self._lock:
+            self._state = state
+            self._failure = failure
+            self._report = report
+            self._finished_at = time.perf_counter()
+            self._elapsed = self._finished_at - self._started
+
+    def snapshot(self):
+        """Cópia consistente do estado (o resultado por linha fica em `ledger`)"""
+        with self._lock:
+            return {
+                "import_id": self.import_id,
+                "file_name": self.file_name,
+                "loader": self.loader,
+                "state": self._state,
+                "stats": dict(self._stats),
+                "rows_read": self._rows_read,
+                "batch_size": self._batch_size,
+                "error_count": self._stats.get("erros", 0),
+                "failure": self._failure,
+                "report": self._report,
+                "elapsed": self._elapsed if self._elapsed is not None else time.perf_counter() - self._started,
+                **self._retries,
+            }
+
+class ImportManager:
+    """Importações em segundo plano, identificadas pelo hash do arquivo.
+
+    Fica no cache de recursos do Streamlit: sobrevive aos reruns da página e é
+    o mesmo para todas as sessões, então um arquivo não é importado duas vezes
+    ao mesmo tempo e qualquer usuário pode acompanhar uma importação. Das
+    concluídas, só as `max_finished` mais recentes são mantidas, e por no
+    máximo `finished_ttl` segundos.
+    """
+
+    def __init__(self, max_finished=FINISHED_IMPORTS_MAX, finished_ttl=FINISHED_IMPORTS_TTL_SECONDS):
+        self.max_finished = max_finished
+        self.finished_ttl = finished_ttl
+        self._lock = threading.Lock()
+        self._imports = {}
+
+    def _evict_finished(self):
+        """Descarta as importações concluídas antigas (chamado com o lock)"""
+        now = time.perf_counter()
+        finished = sorted(
+            ((status.finished_at, import_id) for import_id, status in self._imports.items()
+             if status.finished_at is not None),
+            reverse=True,
+        )
+        for position, (finished_at, import_id) in enumerate(finished):
+            if position >= self.max_finished or now - finished_at > self.finished_ttl:
+                del self._imports[import_id]
+
+    def start(self, import_id, file_name, loader, stats, work):
+        """Roda `work(status)` numa thread; se o arquivo já está sendo importado, retorna o status existente"""
+        with self._lock:
+            self._evict_finished()
+            current = self._imports.get(import_id)
+            if current is not None and current.running:
+                return current
+            status = ImportStatus(import_id, file_name, loader, stats)
+            self._imports[import_id] = status
+        thread = threading.Thread(
+            target=self._run, args=(status, work), name=f"import-{import_id[:8]}", daemon=True
+        )
+        thread.start()
+        return status
+
+    def _run(self, status, work):
+        try:
+            work(status)
+        except Exception as e:
+            logger.exception(f"Importação {status.import_id} falhou")
+            status.finish('failed', failure=str(e))
+        else:
+            if status.running:
+                status.finish('cancelled' if status.cancel_requested else 'done')
+
+    def get(self, import_id):
+        with self._lock:
+            return self._imports.get(import_id)
+
+    def imports(self):
+        """Todas as importações desta instância, as em andamento primeiro"""
+        with self._lock:
+            self._evict_finished()
+            statuses = list(self._imports.values())
+        return sorted(statuses, key=lambda status: not status.running)
+
+def run_import_job(status, source, loader, supabase=None, reference_cache=None, controller=None,
+                   max_in_flight=1, journal=None, delta=False, dedupe=True, parse_workers=0, remove_source=False):
+    """Executa a importação de `source` publicando o progresso em `status`.
+
+    `loader` é 'rest', 'rpc' ou 'copy', como no --loader da linha de comando.
+    Para entre dois lotes se `status.cancel()` for chamado; com o diário, os
+    lotes já gravados são retomados na próxima execução. Com `dedupe`, as linhas
+    substituídas por uma versão mais nova do mesmo ID não são gravadas, mas
+    contam como lidas. Com `remove_source`, o arquivo é apagado no fim (cópia
+    temporária do upload).
+    """
+    stats = status.snapshot()["stats"]
+    started = time.perf_counter()
+    try:
+        # Retentativas e métricas só desta importação, mesmo com outras rodando no processo
+        with counting_retries(RetryStats()) as retries, pipeline_metrics.scope() as metrics:
+            if loader == 'copy':
+                rows_read = 0
+                batches = run_bulk_load(source, stats, dedupe=dedupe, ledger=status.ledger)
+            else:
+                rows_read = journal.rows_done if journal is not None else 0
+                status.update(stats, rows_read)
+                batches = run_import(
+                    source, supabase, reference_cache, controller, max_in_flight, stats, journal, delta, loader == 'rpc',
+                    dedupe, parse_workers, status.ledger,
+                )
+
+            for batch_df, _ in batches:
+                rows_read += len(batch_df)
+                stats["total"] = max(stats["total"], rows_read + stats["duplicados"])
+                status.update(
+                    stats, rows_read + stats["duplicados"],
+                    batch_size=controller.batch_size if controller is not None and loader != 'copy' else None,
+                    retries=retries.snapshot(),
+                )
+                if status.cancel_requested:
+                    batches.close()
+                    break
+
+            # A estimativa é substituída pela contagem real
+            if not status.cancel_requested:
+                stats["total"] = rows_read + stats["duplicados"]
+            status.update(stats, rows_read + stats["duplicados"], retries=retries.snapshot())
+
+            # Persiste os ids conhecidos para as próximas execuções
+            if reference_cache is not None:
+                try:
+                    with borrow_client(supabase) as client:
+                        reference_cache.save_snapshot(client)
+                except Exception as e:
+                    logger.warning(f"Não foi possível salvar o cache de referências: {str(e)}")
+
+        elapsed = time.perf_counter() - started
+        report = {"metrics": metrics.since({}), "elapsed": elapsed}
+        if isinstance(supabase, SupabaseClientPool):
+            report["client_pool"] = supabase.stats()
+        status.finish('cancelled' if status.cancel_requested else 'done', report=report)
+    finally:
+        if remove_source:
+            try:
+                os.remove(source)
+            except OSError:
+                pass
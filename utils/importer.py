@@ -0,0 +1,320 @@
+import logging
+import time
+from functools import partial
+
+import numpy as np
+
+from utils.batch_controller import counting_retries, write_bisecting
+from utils.batch_runner import batch_job_ids, run_batches
+from utils.constants import DEFERRED_COLUMNS, INPUT_COLUMNS
+from utils.deduplication import drop_superseded, find_superseded_rows
+from utils.data_processor import is_unchanged, job_fingerprint, named_skills, prepare_jobs_frame, process_skills, sync_job_skills
+from utils.file_loader import BodyReader, can_defer_body, iter_chunks
+from utils.instrumentation import pipeline_metrics, timed_iter
+from utils.parse_pool import iter_parsed
+from utils.supabase_handler import borrow_client, fetch_existing_jobs, has_fingerprint_column, import_jobs_rpc, rpc_entry, upsert_jobs, verify_company, verify_title
+
+logger = logging.getLogger(__name__)
+
+def initialize_metrics():
+    """Inicializa as métricas com valores zero"""
+    return {
+        "total": 0,
+        "processados": 0,
+        "atualizados": 0,
+        "novos": 0,
+        "inalterados": 0,
+        "erros": 0,
+        "duplicados": 0
+    }
+
+def merge_metrics(stats, batch_stats):
+    """Soma no total as métricas de um lote processado em outra thread"""
+    for key in ("processados", "atualizados", "novos", "inalterados", "erros"):
+        stats[key] += batch_stats[key]
+    return stats
+
+def iter_batches(source, batch_size, journal=None, superseded=None):
+    """Gera os lotes do arquivo, um pedaço por vez
+
+    `batch_size` é uma função chamada a cada lote, o que permite ao controle
+    adaptativo mudar o tamanho durante a importação. Com `journal`, as linhas
+    já gravadas numa execução anterior são puladas; `superseded` são as linhas
+    substituídas por uma versão mais nova do mesmo ID (ver find_superseded_rows).
+
+    Os pedaços são lidos sem BODY, que é lido à parte só para as linhas de
+    cada lote (ver BodyReader), quando o arquivo permite uma segunda leitura.
+    """
+    bodies = BodyReader(source) if can_defer_body(source) else None
+    columns = [name for name in INPUT_COLUMNS if name not in DEFERRED_COLUMNS] if bodies is not None else None
+    for chunk in timed_iter(iter_chunks(source, columns=columns), 'file_read'):
+        if journal is not None:
+            chunk = journal.filter_pending(chunk)
+        if superseded is not None:
+            chunk = drop_superseded(chunk, superseded)
+        i = 0
+        while i < len(chunk):
+            size = batch_size()
+            batch = chunk.iloc[i:i+size]
+            if bodies is not None:
+                with pipeline_metrics.stage('file_read'):
+                    batch = batch.assign(BODY=bodies.take(batch.index))
+            yield batch
+            i += size
+
+def parse_batch(df_batch, fingerprint=False):
+    """Parte de CPU de um lote: prepara os jobs e separa as linhas inválidas
+
+    Não acessa o banco, então pode rodar num processo do pool de parsing (ver
+    iter_parsed). Retorna (preparados, inválidos), listas de (índice, linha, job)
+    e de (índice, linha, erro). Com `fingerprint`, os jobs já saem com o
+    import_fingerprint, gravado junto com o job e comparado pelo modo delta.
+    """
+    with pipeline_metrics.stage('prepare_job_data'):
+        jobs, prepare_errors = prepare_jobs_frame(df_batch)
+        # BODY só é lido em prepare_jobs_frame: as linhas em dict ficam sem ele
+        rows = df_batch.drop(columns=['BODY'], errors='ignore').to_dict('records')
+        prepared = []
+        invalid = []
+        for index, row, job_data, prepare_error in zip(df_batch.index, rows, jobs, prepare_errors):
+            if prepare_error is not None:
+                invalid.append((index, row, prepare_error))
+                continue
+            if fingerprint:
+                job_data["import_fingerprint"] = job_fingerprint(job_data)
+            prepared.append((index, row, job_data))
+    return prepared, invalid
+
+def process_batch(df_batch, supabase, stats, reference_cache=None, delta=False, rpc=False, ledger=None, fingerprint=False):
+    """Processa um lote de dados (parse_batch seguido de write_batch)"""
+    return write_batch(parse_batch(df_batch, fingerprint or delta or rpc), supabase, stats, reference_cache, delta, rpc, ledger)
+
+def write_batch(parsed, supabase, stats, reference_cache=None, delta=False, rpc=False, ledger=None):
+    """Grava um lote já preparado por parse_batch
+
+    Com `reference_cache`, company/title/skills do lote são garantidos com consultas em lote
+    e os vínculos de job_skill são sincronizados pela diferença. Com `delta`, jobs
+    idênticos ao que já está no banco são pulados e contados como inalterados.
+    Com `rpc`, o lote inteiro é gravado numa chamada à função import_jobs_batch.
+    Com `ledger` (OutcomeLedger), o resultado de cada linha é registrado nele.
+
+    Retorna (stats, mensagens de erro, índices das linhas com erro).
+    """
+    error_messages = []
+    failed = []
+
+    def register_error(index, row, message):
+        stats["erros"] += 1
+        failed.append(index)
+        error_message = f"Erro na linha {index + 1}, Job ID {row.get('ID', 'desconhecido')}: {message}"
+        logger.debug(error_message)
+        error_messages.append(error_message)
+        if ledger is not None:
+            ledger.record(index, 'erro', message, row.get('ID', 'desconhecido'))
+
+    def register_written(index, result):
+        stats["processados"] += 1
+        if result == 'inserted':
+            stats["novos"] += 1
+        else:
+            stats["atualizados"] += 1
+        if ledger is not None:
+            ledger.record(index, 'novo' if result == 'inserted' else 'atualizado')
+
+    prepared, invalid = parsed
+    for index, row, prepare_error in invalid:
+        register_error(index, row, prepare_error)
+
+    # Modo delta: descarta os jobs cujo conteúdo não mudou
+    existing = None
+    if delta and prepared:
+        try:
+            with pipeline_metrics.stage('delta_check'):
+                existing = fetch_existing_jobs(
+                    {job_data['id'] for _, _, job_data in prepared}, supabase,
+                    columns='id, import_fingerprint, last_updated_date'
+                )
+        except Exception as e:
+            for index, row, _ in prepared:
+                register_error(index, row, str(e))
+            return stats, error_messages, failed
+        changed = []
+        for index, row, job_data in prepared:
+            if is_unchanged(job_data, existing.get(job_data['id'])):
+                stats["inalterados"] += 1
+                if ledger is not None:
+                    ledger.record(index, 'inalterado')
+            else:
+                changed.append((index, row, job_data))
+        prepared = changed
+
+    # Modo RPC: referências, jobs e job_skill numa única requisição
+    if rpc:
+        # Uma linha com company/title inválido não derruba a montagem do lote
+        entries = []
+        for index, row, job_data in prepared:
+            try:
+                entries.append((index, row, rpc_entry(row, job_data)))
+            except Exception as e:
+                register_error(index, row, str(e))
+        if not entries:
+            return stats, error_messages, failed
+        try:
+            with pipeline_metrics.stage('job_write'):
+                results = import_jobs_rpc([entry for _, _, entry in entries], supabase)
+        except Exception as e:
+            for index, row, _ in entries:
+                register_error(index, row, str(e))
+            return stats, error_messages, failed
+        for (index, row, _), (result, error) in zip(entries, results):
+            if result == 'error':
+                register_error(index, row, error)
+            else:
+                register_written(index, result)
+        return stats, error_messages, failed
+
+    # Garante company/title antes da gravação em lote
+    if reference_cache is None:
+        verified = []
+        for index, row, job_data in prepared:
+            try:
+                with pipeline_metrics.stage('reference_verification'):
+                    verify_company(row, supabase, job_data)
+                    verify_title(row, supabase, job_data)
+                verified.append((index, row, job_data))
+            except Exception as e:
+                register_error(index, row, str(e))
+        prepared = verified
+
+    if not prepared:
+        return stats, error_messages, failed
+
+    if reference_cache is not None:
+        # Uma referência inválida derruba a gravação em lote: write_bisecting isola as linhas com problema
+        with pipeline_metrics.stage('reference_verification'):
+            _, failures = write_bisecting(range(len(prepared)), lambda part: reference_cache.prefetch(
+                [prepared[position][1] for position in part], supabase, [prepared[position][2] for position in part]
+            ))
+        for position, error in sorted(failures.items()):
+            index, row, _ = prepared[position]
+            register_error(index, row, error)
+        prepared = [item for position, item in enumerate(prepared) if position not in failures]
+        if not prepared:
+            return stats, error_messages, failed
+
+    # Grava todos os jobs do lote com poucas chamadas de upsert
+    try:
+        with pipeline_metrics.stage('job_write'):
+            results = upsert_jobs(
+                [job_data for _, _, job_data in prepared], supabase,
+                existing_ids=set(existing) if existing is not None else None
+            )
+    except Exception as e:
+        for index, row, _ in prepared:
+            register_error(index, row, str(e))
+        return stats, error_messages, failed
+
+    written = []
+    for (index, row, job_data), (result, error) in zip(prepared, results):
+        if result == 'error':
+            register_error(index, row, error)
+        else:
+            written.append((index, row, job_data, result))
+
+    # Com o cache as skills já existem: sincroniza job_skill do lote inteiro pela diferença
+    if reference_cache is not None and written:
+        with pipeline_metrics.stage('skill_sync'):
+            # Só as skills com nome (as criadas pelo prefetch) são vinculadas
+            _, failures = write_bisecting(range(len(written)), lambda part: sync_job_skills(
+                [written[position][2] for position in part], supabase,
+                [[skill_id for skill_id, _ in named_skills(written[position][1], written[position][2].get('skills', []))]
+                 for position in part]
+            ))
+        for position, error in sorted(failures.items()):
+            index, row, _, _ = written[position]
+            register_error(index, row, error)
+        written = [item for position, item in enumerate(written) if position not in failures]
+
+    for index, row, _, result in written:
+        try:
+            if reference_cache is None:
+                with pipeline_metrics.stage('skill_sync'):
+                    process_skills(row, supabase)
+            register_written(index, result)
+        except Exception as e:
+            register_error(index, row, str(e))
+
+    return stats, error_messages, failed
+
+def run_import(source, supabase, reference_cache, controller, max_in_flight, stats, journal=None, delta=False, rpc=False,
+               dedupe=True, parse_workers=0, ledger=None):
+    """Importa o arquivo inteiro, somando os resultados em `stats`.
+
+    Gera (lote, erros do lote) a cada lote concluído, para quem chama atualizar
+    o progresso (página do Streamlit ou linha de comando). Com `journal`, as
+    linhas gravadas (ou inalteradas) de cada lote concluído são registradas em
+    disco para permitir retomar a importação; as linhas com erro ficam de fora
+    e são repetidas na próxima execução. Com `delta`, só os jobs alterados são
+    gravados; com `rpc`, cada lote é uma chamada à função import_jobs_batch
+    (ver process_batch). Com `dedupe`, só a versão mais nova de cada ID do
+    arquivo é gravada e as demais são contadas em `stats["duplicados"]`.
+
+    Com `parse_workers`, o parsing dos lotes (parse_batch) roda nesse número de
+    processos, à frente das `max_in_flight` threads que gravam; sem ele, cada
+    thread prepara o próprio lote antes de gravar. `supabase` pode ser um
+    cliente ou um SupabaseClientPool, do qual cada lote empresta um cliente.
+    Com `ledger` (OutcomeLedger), o resultado de cada linha fica registrado,
+    inclusive as linhas duplicadas e as gravadas em execuções anteriores.
+    """
+    def process(item):
+        batch_df, parsed = item
+        started = time.perf_counter()
+        if parsed is None:
+            parsed = parse_batch(batch_df, fingerprint)
+        # As retentativas deste lote contam só para o controlador desta importação
+        with counting_retries(controller.retry_stats), borrow_client(supabase) as client:
+            result = write_batch(parsed, client, initialize_metrics(), reference_cache, delta, rpc, ledger)
+        controller.record_batch(len(batch_df), time.perf_counter() - started)
+        return result
+
+    # Todo caminho de gravação atualiza import_fingerprint quando a coluna existe;
+    # senão um job gravado fora do modo delta ficaria com o hash da versão anterior
+    # (a função RPC cria a coluna)
+    with borrow_client(supabase) as client:
+        fingerprint = rpc or has_fingerprint_column(client)
+    if delta and not fingerprint:
+        raise ValueError("O modo de registros alterados requer a coluna jobs.import_fingerprint (ver database.md)")
+
+    superseded = find_superseded_rows(source) if dedupe else None
+    if superseded is not None:
+        stats["duplicados"] = len(superseded)
+    if ledger is not None:
+        if journal is not None:
+            for start, end in journal.ranges:
+                ledger.record_rows(np.arange(start, end), 'anterior')
+        if superseded is not None:
+            ledger.record_rows(superseded, 'duplicado')
+
+    batches = iter_batches(source, controller.next_batch_size, journal, superseded)
+    if parse_workers:
+        # Dois lotes prontos por thread de gravação, no mínimo um por processo
+        items = iter_parsed(
+            batches, partial(parse_batch, fingerprint=fingerprint), parse_workers,
+            queue_size=max(2 * max_in_flight, parse_workers)
+        )
+    else:
+        items = ((batch_df, None) for batch_df in batches)
+
+    failed_rows = 0
+    for (batch_df, _), (batch_stats, errors, failed) in run_batches(
+        items, process, max_in_flight, batch_keys=lambda item: batch_job_ids(item[0])
+    ):
+        merge_metrics(stats, batch_stats)
+        failed_rows += len(failed)
+        if journal is not None:
+            journal.record_batch(batch_df.index, batch_stats, failed)
+        yield batch_df, errors
+
+    # Com linhas a repetir, a próxima execução ainda tem o que gravar
+    if journal is not None and not failed_rows:
+        journal.mark_complete()
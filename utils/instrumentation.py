@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Métricas das importações em andamento no contexto atual (ver PipelineMetrics.scope)
+_scopes = ContextVar('pipeline_metrics_scopes', default=())
+
+class PipelineMetrics:
+    """Tempo e número de chamadas por etapa da importação e requisições por tabela/operação.
+
+    Compartilhado por todas as threads; para medir uma importação, guarde
+    `snapshot()` no início e use `since(inicio)` no fim, ou, com várias
+    importações no mesmo processo, meça cada uma com `scope()`.
+    """
+
+    def __init__(self, scoped=False):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._requests = {}
+        self._scoped = scoped
+
+    def _collectors(self):
+        # As métricas de um escopo recebem só o que foi medido no seu contexto
+        return (self,) if self._scoped else (self,) + _scopes.get()
+
+    @contextmanager
+    def scope(self):
+        """Métricas só do que roda neste contexto: o bloco e as threads de run_batches"""
+        metrics = PipelineMetrics(scoped=True)
+        token = _scopes.set(_scopes.get() + (metrics,))
+        try:
+            yield metrics
+        finally:
+            _scopes.reset(token)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - started)
+
+    def record_stage(self, name, seconds, calls=1):
+        for metrics in self._collectors():
+            with metrics._lock:
+                entry = metrics._stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+                entry["calls"] += calls
+                entry["seconds"] += seconds
+
+    def record_request(self, table, operation, seconds, failed=False):
+        key = f"{table}.{operation}"
+        for metrics in self._collectors():
+            with metrics._lock:
+                entry = metrics._requests.setdefault(key, {"count": 0, "seconds": 0.0, "errors": 0})
+                entry["count"] += 1
+                entry["seconds"] += seconds
+                entry["errors"] += int(failed)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "stages": {name: dict(entry) for name, entry in self._stages.items()},
+                "requests": {key: dict(entry) for key, entry in self._requests.items()},
+            }
+
+    def since(self, before):
+        """Diferença entre o estado atual e um `snapshot()` anterior"""
+        current = self.snapshot()
+        report = {}
+        for section in ("stages", "requests"):
+            report[section] = {}
+            for key, entry in current[section].items():
+                previous = before.get(section, {}).get(key, {})
+                delta = {field: value - previous.get(field, 0) for field, value in entry.items()}
+                if any(delta.values()):
+                    report[section][key] = delta
+        return report
+
+pipeline_metrics = PipelineMetrics()
+
+def timed_iter(iterable, stage_name):
+    """Repassa os itens de `iterable` medindo o tempo gasto para produzir cada um"""
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            pipeline_metrics.record_stage(stage_name, time.perf_counter() - started)
+        yield item
+
+def report_rows(report, rows_read, elapsed):
+    """Transforma o relatório em linhas de tabela (etapas e requisições) para exibição"""
+    stages = [
+        {"etapa": name, "chamadas": entry["calls"], "segundos": round(entry["seconds"], 3),
+         "% do tempo": round(100 * entry["seconds"] / elapsed, 1) if elapsed else None}
+        for name, entry in sorted(report["stages"].items(), key=lambda item: -item[1]["seconds"])
+    ]
+    requests = [
+        {"tabela.operação": key, "requisições": entry["count"], "erros": entry["errors"],
+         "segundos": round(entry["seconds"], 3),
+         "por linha": round(entry["count"] / rows_read, 3) if rows_read else None}
+        for key, entry in sorted(report["requests"].items(), key=lambda item: -item[1]["count"])
+    ]
+    return stages, requests
+
+def report_json(report, **extra):
+    return json.dumps({**extra, **report}, ensure_ascii=False, indent=2)
@@ -0,0 +1,194 @@
+import csv
+import io
+import re
+import tempfile
+import threading
+
+import numpy as np
+
+# Resultado de cada linha; o índice é o valor guardado no array
+OUTCOMES = ['pendente', 'novo', 'atualizado', 'inalterado', 'erro', 'duplicado', 'anterior', 'gravado']
+OUTCOME_CODES = {outcome: code for code, outcome in enumerate(OUTCOMES)}
+ERROR = OUTCOME_CODES['erro']
+
+# Erros sem código do Postgres/PostgREST são classificados pela etapa que falhou
+ERROR_PREFIXES = [
+    ('Erro ao preparar dados', 'dados'),
+    ('Erro ao verificar referências', 'referencias'),
+    ('Erro ao verificar company', 'referencias'),
+    ('Erro ao verificar title', 'referencias'),
+    ('Erro ao sincronizar skills', 'skills'),
+]
+_API_ERROR_CODE = re.compile(r"'code': '([^']+)'")
+
+CSV_HEADER = ['linha', 'resultado', 'codigo_erro', 'job_id', 'erro']
+
+def error_code(message):
+    """Código de um erro: o do Postgres/PostgREST quando presente, senão a etapa que falhou"""
+    match = _API_ERROR_CODE.search(message)
+    if match:
+        return match.group(1)
+    for prefix, code in ERROR_PREFIXES:
+        if message.startswith(prefix):
+            return code
+    return 'outro'
+
+class OutcomeLedger:
+    """Resultado de cada linha do arquivo, em arrays indexados pelo índice da linha.
+
+    Guarda um byte de resultado e o índice da mensagem de erro por linha; as
+    mensagens repetidas são guardadas uma vez só e o Job ID só é mantido para
+    as linhas com erro. Compartilhado pelas threads de gravação.
+    """
+
+    def __init__(self, capacity=1024):
+        self._lock = threading.Lock()
+        self._outcomes = np.zeros(capacity, dtype=np.uint8)
+        self._messages = np.full(capacity, -1, dtype=np.int32)
+        self._size = 0
+        self._message_index = {}
+        self._message_texts = []
+        self._message_codes = []
+        self._job_ids = {}
+
+    def _reserve(self, size):
+        if size > len(self._outcomes):
+            capacity = max(size, 2 * len(self._outcomes))
+            outcomes = np.zeros(capacity, dtype=np.uint8)
+            outcomes[:self._size] = self._outcomes[:self._size]
+            messages = np.full(capacity, -1, dtype=np.int32)
+            messages[:self._size] = self._messages[:self._size]
+            self._outcomes, self._messages = outcomes, messages
+        self._size = max(self._size, size)
+
+    def _intern(self, message):
+        position = self._message_index.get(message)
+        if position is None:
+            position = len(self._message_texts)
+            self._message_index[message] = position
+            self._message_texts.append(message)
+            self._message_codes.append(error_code(message))
+        return position
+
+    def record(self, index, outcome, message=None, job_id=None):
+        """Registra o resultado da linha `index`; `message` e `job_id` só para erros"""
+        index = int(index)
+        with self._lock:
+            self._reserve(index + 1)
+            self._outcomes[index] = OUTCOME_CODES[outcome]
+            self._messages[index] = self._intern(message) if message is not None else -1
+            if job_id is not None and outcome == 'erro':
+                self._job_ids[index] = str(job_id)
+            else:
+                self._job_ids.pop(index, None)
+
+    def record_rows(self, indexes, outcome):
+        """Registra o mesmo resultado (sem erro) para várias linhas"""
+        indexes = np.asarray(indexes, dtype=np.int64)
+        if len(indexes) == 0:
+            return
+        with self._lock:
+            self._reserve(int(indexes.max()) + 1)
+            self._outcomes[indexes] = OUTCOME_CODES[outcome]
+            self._messages[indexes] = -1
+
+    def counts(self):
+        """Quantidade de linhas por resultado"""
+        with self._lock:
+            counts = np.bincount(self._outcomes[:self._size], minlength=len(OUTCOMES))
+        return {outcome: int(count) for outcome, count in zip(OUTCOMES, counts)}
+
+    def error_codes(self):
+        """Códigos de erro presentes, com a quantidade de linhas de cada um"""
+        with self._lock:
+            messages = self._messages[:self._size][self._outcomes[:self._size] == ERROR]
+            codes = list(self._message_codes)
+        totals = {}
+        for position, count in zip(*np.unique(messages[messages >= 0], return_counts=True)):
+            totals[codes[position]] = totals.get(codes[position], 0) + int(count)
+        return dict(sorted(totals.items()))
+
+    def errors(self, offset=0, limit=50, code=None, search=None):
+        """Uma página das linhas com erro, filtrada por código e por texto (Job ID ou mensagem).
+
+        Retorna (total de linhas que passam no filtro, linhas da página).
+        """
+        with self._lock:
+            outcomes = self._outcomes[:self._size]
+            messages = self._messages[:self._size]
+            texts = list(self._message_texts)
+            codes = list(self._message_codes)
+            mask = outcomes == ERROR
+            # O filtro é aplicado nas mensagens distintas, não em cada linha; o
+            # último item (False) é o das linhas sem mensagem (índice -1)
+            if code is not None or search:
+                needle = search.lower() if search else None
+                accepted = np.array([
+                    (code is None or codes[position] == code)
+                    and (needle is None or needle in texts[position].lower())
+                    for position in range(len(texts))
+                ] + [False], dtype=bool)
+                by_message = accepted[messages]
+                if needle is not None:
+                    by_job_id = np.zeros(len(outcomes), dtype=bool)
+                    matching = [
+                        index for index, job_id in self._job_ids.items()
+                        if index < len(outcomes) and needle in job_id.lower()
+                        and (code is None or (messages[index] >= 0 and codes[messages[index]] == code))
+                    ]
+                    by_job_id[matching] = True
+                    by_message |= by_job_id
+                mask &= by_message
+            rows = np.flatnonzero(mask)
+            page = rows[offset:offset + limit]
+            return len(rows), [
+                {
+                    "linha": int(index) + 1,
+                    "job_id": self._job_ids.get(int(index), ''),
+                    "codigo_erro": codes[messages[index]] if messages[index] >= 0 else '',
+                    "erro": texts[messages[index]] if messages[index] >= 0 else '',
+                }
+                for index in page
+            ]
+
+    def iter_csv(self, rows_per_chunk=50000):
+        """Relatório completo (uma linha por linha do arquivo) em CSV, gerado em pedaços de texto"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_HEADER)
+        with self._lock:
+            size = self._size
+        for start in range(0, size, rows_per_chunk):
+            with self._lock:
+                outcomes = self._outcomes[start:start + rows_per_chunk].copy()
+                messages = self._messages[start:start + rows_per_chunk].copy()
+                texts = list(self._message_texts)
+                codes = list(self._message_codes)
+                job_ids = {
+                    int(index): self._job_ids[int(index)]
+                    for index in np.flatnonzero(outcomes == ERROR) + start if int(index) in self._job_ids
+                }
+            for offset, (outcome, message) in enumerate(zip(outcomes, messages)):
+                index = start + offset
+                writer.writerow([
+                    index + 1, OUTCOMES[outcome],
+                    codes[message] if message >= 0 else '', job_ids.get(index, ''),
+                    texts[message] if message >= 0 else '',
+                ])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def csv_bytes(self):
+        """Relatório em CSV inteiro em memória, para o st.download_button.
+
+        Os pedaços passam por um arquivo temporário, para que o relatório
+        fique na memória uma vez só (e não os pedaços mais a junção deles).
+        """
+        with tempfile.TemporaryFile(mode='w+b') as f:
+            for text in self.iter_csv():
+                f.write(text.encode('utf-8'))
+            f.seek(0)
+            return f.read()
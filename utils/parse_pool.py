@@ -0,0 +1,54 @@
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.constants import PARSE_WORKERS_DEFAULT
+from utils.instrumentation import pipeline_metrics
+
+def default_parse_workers():
+    """PARSE_WORKERS_DEFAULT, deixando um núcleo livre para a leitura e a gravação"""
+    return max(0, min(PARSE_WORKERS_DEFAULT, (os.cpu_count() or 1) - 1))
+
+def _timed_call(function, item):
+    """Roda `function(item)` no processo filho; devolve também o tempo e as etapas medidas nele"""
+    metrics_before = pipeline_metrics.snapshot()
+    started = time.perf_counter()
+    result = function(item)
+    return result, time.perf_counter() - started, pipeline_metrics.since(metrics_before)["stages"]
+
+def iter_parsed(batches, parse, workers, queue_size, stage_name='prepare_job_data'):
+    """Gera (lote, parse(lote)) com o parsing feito em `workers` processos.
+
+    Os lotes são lidos à frente de quem consome o gerador: até `queue_size`
+    lotes ficam sendo preparados ou prontos à espera das threads de gravação,
+    que assim não ficam paradas esperando o parsing. A fila é limitada, então
+    quando a gravação fica para trás a leitura do arquivo também para. A ordem
+    dos lotes é mantida. `parse` precisa ser serializável (função de módulo ou
+    partial de uma). As etapas medidas nos processos (ex.: array_parsing) são
+    somadas às métricas deste processo; se `parse` não mede `stage_name`, o
+    tempo total da chamada é somado nela.
+    """
+    # spawn: o processo do Streamlit tem várias threads, e fork com threads pode travar
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    queue = deque()
+
+    def next_parsed():
+        batch, future = queue.popleft()
+        result, seconds, stages = future.result()
+        for name, entry in stages.items():
+            pipeline_metrics.record_stage(name, entry["seconds"], entry["calls"])
+        if stage_name not in stages:
+            pipeline_metrics.record_stage(stage_name, seconds)
+        return batch, result
+
+    try:
+        for batch in batches:
+            queue.append((batch, executor.submit(_timed_call, parse, batch)))
+            if len(queue) >= max(1, queue_size):
+                yield next_parsed()
+        while queue:
+            yield next_parsed()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
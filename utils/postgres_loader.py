@@ -0,0 +1,224 @@
+"""Carga direta no Postgres do Supabase: COPY para tabelas de staging e merge em SQL.
+
+Alternativa à gravação pela API REST para recargas completas. Requer o pacote
+opcional `psycopg` (versão 3) e a URL de conexão do banco em SUPABASE_DB_URL.
+"""
+import logging
+import os
+import uuid
+
+from dotenv import load_dotenv
+import pandas as pd
+
+from utils.constants import JOB_FIELDS
+from utils.data_processor import job_fingerprint, named_skills, prepare_jobs_frame
+from utils.deduplication import drop_superseded, find_superseded_rows
+from utils.file_loader import iter_chunks
+from utils.instrumentation import pipeline_metrics, timed_iter
+from utils.reference_cache import collect_references
+
+try:
+    import psycopg
+except ImportError:  # dependência opcional
+    psycopg = None
+
+logger = logging.getLogger(__name__)
+
+STAGE_JOB_COLUMNS = JOB_FIELDS + ['last_update_import', 'import_fingerprint']
+
+def bulk_load_available():
+    """Indica se o psycopg está instalado"""
+    return psycopg is not None
+
+def database_url():
+    """URL de conexão direta com o Postgres (SUPABASE_DB_URL no .env)"""
+    load_dotenv()
+    return os.getenv("SUPABASE_DB_URL")
+
+def connect(dsn=None):
+    if psycopg is None:
+        raise ValueError("A carga direta no Postgres requer o pacote psycopg (pip install \"psycopg[binary]\")")
+    dsn = dsn or database_url()
+    if not dsn:
+        raise ValueError("URL do Postgres não encontrada: defina SUPABASE_DB_URL no arquivo .env")
+    return psycopg.connect(dsn)
+
+def _stage_names():
+    """Nomes únicos das tabelas de staging desta carga (só hex, seguros para interpolar)"""
+    suffix = uuid.uuid4().hex[:12]
+    return {
+        'jobs': f"import_stage_{suffix}_jobs",
+        'company': f"import_stage_{suffix}_company",
+        'title_taxonomy': f"import_stage_{suffix}_title",
+        'skill_2_skill_pt_br': f"import_stage_{suffix}_skill",
+    }
+
+def _job_columns(cursor):
+    """Colunas de jobs gravadas pela carga: import_fingerprint só se a coluna existir (ver database.md)"""
+    cursor.execute(
+        "select 1 from information_schema.columns"
+        " where table_schema = 'public' and table_name = 'jobs' and column_name = 'import_fingerprint'"
+    )
+    if cursor.fetchone() is None:
+        return [field for field in STAGE_JOB_COLUMNS if field != 'import_fingerprint']
+    return STAGE_JOB_COLUMNS
+
+def _create_stages(cursor, stages):
+    # `like` copia só colunas e tipos, sem chaves nem FKs; seq é a linha no arquivo e
+    # linked_skills as skills a vincular em job_skill (as com nome, ver named_skills)
+    cursor.execute(f"create unlogged table {stages['jobs']} (seq bigint not null, linked_skills text[], like public.jobs)")
+    cursor.execute(f"create unlogged table {stages['company']} (seq bigint not null, id bigint, company_name text)")
+    cursor.execute(f"create unlogged table {stages['title_taxonomy']} (seq bigint not null, id text, name text)")
+    cursor.execute(f"create unlogged table {stages['skill_2_skill_pt_br']} (seq bigint not null, id text, name text)")
+
+def _copy_rows(cursor, table, columns, rows):
+    with cursor.copy(f"copy {table} ({', '.join(columns)}) from stdin") as copy:
+        for row in rows:
+            copy.write_row(row)
+
+def _stage_chunk(cursor, stages, chunk, jobs, columns):
+    """Copia para o staging os jobs válidos do pedaço e as referências que eles usam"""
+    positions = [position for position, job_data in enumerate(jobs) if job_data is not None]
+    seqs = [int(chunk.index[position]) for position in positions]
+    valid_jobs = [jobs[position] for position in positions]
+    rows = chunk.iloc[positions].drop(columns=['BODY'], errors='ignore').to_dict('records')
+    linked_skills = [
+        [skill_id for skill_id, _ in named_skills(row, job_data.get('skills', []))]
+        for row, job_data in zip(rows, valid_jobs)
+    ]
+    _copy_rows(
+        cursor, stages['jobs'], ['seq', 'linked_skills'] + columns,
+        ([seq, linked] + [job_data.get(field) for field in columns]
+         for seq, linked, job_data in zip(seqs, linked_skills, valid_jobs))
+    )
+
+    references = collect_references(rows, valid_jobs)
+    seq = seqs[-1] if seqs else 0
+    _copy_rows(cursor, stages['company'], ['seq', 'id', 'company_name'],
+               ((seq, item['id'], item['company_name']) for item in references['company'].values()))
+    _copy_rows(cursor, stages['title_taxonomy'], ['seq', 'id', 'name'],
+               ((seq, item['id'], item['name']) for item in references['title_taxonomy'].values()))
+    _copy_rows(cursor, stages['skill_2_skill_pt_br'], ['seq', 'id', 'name'],
+               ((seq, item['id'], item['name']) for item in references['skill_2_skill_pt_br'].values()))
+    return len(valid_jobs)
+
+def _merge(cursor, stages, columns):
+    """Aplica o staging nas tabelas finais; retorna (jobs novos, jobs gravados)
+
+    Como no caminho REST, referências já existentes não são alteradas, a última
+    ocorrência de cada job no arquivo é a que vale e campos vazios não
+    sobrescrevem o que já está no banco, exceto import_fingerprint, que é
+    sempre o desta carga.
+    """
+    cursor.execute(f"""
+        insert into public.company (id, company_name)
+        select distinct on (id) id, company_name from {stages['company']} order by id, seq desc
+        on conflict (id) do nothing
+    """)
+    cursor.execute(f"""
+        insert into public.title_taxonomy (id, name, latest_version)
+        select distinct on (id) id, name, true from {stages['title_taxonomy']} order by id, seq desc
+        on conflict (id) do nothing
+    """)
+    cursor.execute(f"""
+        insert into public.skill_2_skill_pt_br (id, name, latest_version)
+        select distinct on (id) id, name, true from {stages['skill_2_skill_pt_br']} order by id, seq desc
+        on conflict (id) do nothing
+    """)
+
+    updates = ', '.join(
+        f"{field} = excluded.{field}" if field == 'import_fingerprint' else f"{field} = coalesce(excluded.{field}, jobs.{field})"
+        for field in columns if field != 'id'
+    )
+    columns = ', '.join(columns)
+    cursor.execute(f"""
+        with merged as (
+            insert into public.jobs as jobs ({columns})
+            select distinct on (id) {columns} from {stages['jobs']} order by id, seq desc
+            on conflict (id) do update set {updates}
+            returning (xmax = 0) as inserted
+        )
+        select count(*) filter (where inserted), count(*) from merged
+    """)
+    inserted, merged = cursor.fetchone()
+
+    # job_skill é reescrito a partir das skills com nome da última ocorrência de
+    # cada job, as mesmas copiadas para o staging de skills (como nos modos REST e RPC)
+    cursor.execute(f"""
+        delete from public.job_skill link
+        using (select distinct id from {stages['jobs']}) staged
+        where link.job = staged.id
+    """)
+    cursor.execute(f"""
+        insert into public.job_skill (job, skill)
+        select distinct latest.id, linked.skill
+        from (select distinct on (id) id, linked_skills from {stages['jobs']} order by id, seq desc) latest
+        cross join lateral unnest(latest.linked_skills) as linked(skill)
+    """)
+    return inserted, merged
+
+def run_bulk_load(source, stats, dsn=None, dedupe=True, ledger=None):
+    """Importa o arquivo inteiro numa única transação via COPY.
+
+    Gera (pedaço, erros do pedaço) enquanto copia para o staging, como
+    run_import, para quem chama atualizar o progresso. Os contadores de
+    processados, novos e atualizados só são preenchidos depois do merge;
+    se a transação falhar nada é gravado e a exceção é propagada. Com `dedupe`,
+    só a versão mais nova de cada ID é copiada, como em run_import. Com
+    `ledger`, as linhas copiadas ficam como 'gravado' depois do commit (o
+    merge em SQL não distingue novas de atualizadas por linha).
+    """
+    superseded = find_superseded_rows(source) if dedupe else None
+    if superseded is not None:
+        stats["duplicados"] = len(superseded)
+        if ledger is not None:
+            ledger.record_rows(superseded, 'duplicado')
+    stages = _stage_names()
+    staged = 0
+    staged_rows = []
+    try:
+        with connect(dsn) as connection:
+            with connection.transaction(), connection.cursor() as cursor:
+                # Recargas completas podem passar do statement_timeout padrão
+                cursor.execute("set local statement_timeout = 0")
+                columns = _job_columns(cursor)
+                _create_stages(cursor, stages)
+
+                for chunk in timed_iter(iter_chunks(source), 'file_read'):
+                    if superseded is not None:
+                        chunk = drop_superseded(chunk, superseded)
+                    with pipeline_metrics.stage('prepare_job_data'):
+                        jobs, prepare_errors = prepare_jobs_frame(chunk)
+                        if 'import_fingerprint' in columns:
+                            for job_data in jobs:
+                                if job_data is not None:
+                                    job_data["import_fingerprint"] = job_fingerprint(job_data)
+                    errors = []
+                    for index, job_id, prepare_error in zip(chunk.index, chunk.get('ID', [None] * len(chunk)), prepare_errors):
+                        if prepare_error is not None:
+                            if pd.isna(job_id) or not str(job_id).strip():
+                                job_id = 'desconhecido'
+                            stats["erros"] += 1
+                            errors.append(f"Erro na linha {index + 1}, Job ID {job_id}: {prepare_error}")
+                            if ledger is not None:
+                                ledger.record(index, 'erro', prepare_error, job_id)
+                    with pipeline_metrics.stage('copy'):
+                        staged += _stage_chunk(cursor, stages, chunk, jobs, columns)
+                    if ledger is not None:
+                        staged_rows.append(chunk.index[[job_data is not None for job_data in jobs]].to_numpy())
+                    yield chunk, errors
+
+                with pipeline_metrics.stage('merge'):
+                    inserted, merged = _merge(cursor, stages, columns)
+                for table in stages.values():
+                    cursor.execute(f"drop table {table}")
+    except Exception as e:
+        raise Exception(f"Erro na carga direta no Postgres: {str(e)}")
+
+    # Só depois do commit: se a transação falhar, as linhas continuam pendentes
+    for rows in staged_rows:
+        ledger.record_rows(rows, 'gravado')
+    stats["processados"] += staged
+    stats["novos"] += inserted
+    stats["atualizados"] += staged - inserted
+    logger.info(f"Carga direta concluída: {merged} jobs distintos gravados, {inserted} novos")
@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from postgrest import ReturnMethod
+
+from utils.batch_controller import execute_query
+from utils.constants import IN_FILTER_CHUNK_SIZE, REFERENCE_CACHE_MAX_SIZE, REFERENCE_TABLES, UPSERT_CHUNK_SIZE
+from utils.data_processor import chunked, named_skills
+from utils.supabase_handler import company_payload, title_payload
+
+logger = logging.getLogger(__name__)
+
+def collect_references(rows, jobs=None):
+    """Agrupa por tabela os registros de company, title e skill que um lote precisa
+
+    Com `jobs` (payloads alinhados com `rows`), os ids de company, title e skill
+    vêm dos payloads já preparados.
+    """
+    references = {table: {} for table in REFERENCE_TABLES}
+    for position, row in enumerate(rows):
+        job_data = jobs[position] if jobs is not None else None
+        company_data = company_payload(row, job_data)
+        if company_data:
+            references['company'][company_data['id']] = company_data
+        title_data = title_payload(row, job_data)
+        if title_data:
+            references['title_taxonomy'][title_data['id']] = title_data
+        skills = job_data.get('skills', []) if job_data is not None else None
+        for skill_id, skill_name in named_skills(row, skills):
+            references['skill_2_skill_pt_br'].setdefault(skill_id, {
+                "id": skill_id,
+                "name": skill_name,
+                "latest_version": True
+            })
+    return references
+
+class ReferenceCache:
+    """Cache limitado (LRU) dos ids já existentes nas tabelas de referência.
+
+    Compartilhado entre lotes e sessões; pode ser persistido em disco com
+    `save_snapshot` e recarregado com `load_snapshot`.
+    """
+
+    def __init__(self, max_size=REFERENCE_CACHE_MAX_SIZE, snapshot_path=None):
+        self.max_size = max_size
+        self.snapshot_path = snapshot_path
+        self._known = {table: OrderedDict() for table in REFERENCE_TABLES}
+        self._lock = threading.Lock()
+
+    def contains(self, table, item_id):
+        with self._lock:
+            known = self._known[table]
+            if item_id in known:
+                known.move_to_end(item_id)
+                return True
+            return False
+
+    def add(self, table, item_ids):
+        with self._lock:
+            known = self._known[table]
+            for item_id in item_ids:
+                known[item_id] = None
+                known.move_to_end(item_id)
+            while len(known) > self.max_size:
+                known.popitem(last=False)
+
+    def size(self, table):
+        with self._lock:
+            return len(self._known[table])
+
+    def ensure(self, table, records, supabase_client):
+        """Garante que os registros existam na tabela, consultando só os ids fora do cache.
+
+        `records` é um dict {id: registro}. Os ids ausentes são buscados com um
+        filtro in_ e os que não existirem são criados em lote.
+        """
+        missing = [item_id for item_id in records if not self.contains(table, item_id)]
+        if not missing:
+            return 0
+
+        found = set()
+        for chunk in chunked(missing, IN_FILTER_CHUNK_SIZE):
+            result = execute_query(supabase_client.table(table).select('id').in_('id', chunk), table, 'select')
+            found.update(item['id'] for item in result.data)
+
+        to_create = [records[item_id] for item_id in missing if item_id not in found]
+        for chunk in chunked(to_create, UPSERT_CHUNK_SIZE):
+            # ignore_duplicates evita conflito com outra sessão criando o mesmo registro
+            execute_query(
+                supabase_client.table(table).upsert(
+                    chunk, on_conflict='id', ignore_duplicates=True, returning=ReturnMethod.minimal
+                ), table, 'upsert'
+            )
+
+        self.add(table, missing)
+        return len(to_create)
+
+    def prefetch(self, rows, supabase_client, jobs=None):
+        """Garante company, title_taxonomy e skill_2_skill_pt_br para um lote de linhas"""
+        try:
+            references = collect_references(rows, jobs)
+            return {
+                table: self.ensure(table, references[table], supabase_client)
+                for table in REFERENCE_TABLES
+            }
+        except Exception as e:
+            raise Exception(f"Erro ao verificar referências: {str(e)}")
+
+    def _table_count(self, table, supabase_client):
+        result = execute_query(supabase_client.table(table).select('id', count='exact').limit(1), table, 'count')
+        return result.count
+
+    def save_snapshot(self, supabase_client):
+        """Grava os ids conhecidos em disco junto com a contagem atual de cada tabela"""
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            ids = {table: list(known) for table, known in self._known.items()}
+        snapshot = {
+            table: {"count": self._table_count(table, supabase_client), "ids": ids[table]}
+            for table in REFERENCE_TABLES
+        }
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def load_snapshot(self, supabase_client):
+        """Carrega o snapshot do disco, descartando tabelas que perderam linhas desde então"""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            for table in REFERENCE_TABLES:
+                entry = snapshot.get(table)
+                if not entry:
+                    continue
+                # Se a tabela encolheu, algum id do snapshot pode não existir mais
+                if self._table_count(table, supabase_client) < entry['count']:
+                    logger.info(f"Snapshot de {table} descartado: tabela mudou")
+                    continue
+                self.add(table, entry['ids'])
+        except Exception as e:
+            logger.warning(f"Erro ao carregar snapshot do cache de referências: {str(e)}")
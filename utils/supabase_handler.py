@@ -1,82 +1,346 @@
-from supabase import create_client
+from supabase import ClientOptions, create_client
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
 from dotenv import load_dotenv
+import httpx
 import pandas as pd
+from postgrest.exceptions import APIError
+from postgrest import ReturnMethod
 import logging
 
-from utils.data_processor import prepare_job_data
+from utils.batch_controller import execute_query, write_bisecting
+from utils.constants import (
+    IN_FILTER_CHUNK_SIZE,
+    SUPABASE_CONNECT_TIMEOUT_SECONDS,
+    SUPABASE_CONNECTIONS_PER_CLIENT,
+    SUPABASE_KEEPALIVE_SECONDS,
+    SUPABASE_POOL_SIZE,
+    SUPABASE_REQUEST_TIMEOUT_SECONDS,
+    UPSERT_CHUNK_SIZE,
+)
+from utils.data_processor import chunked, named_skills
 
-def init_supabase():
-    """Inicializa a conexão com o Supabase"""
+try:
+    import h2  # HTTP/2 no httpx (pip install "httpx[http2]")
+except ImportError:  # dependência opcional
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+def supabase_credentials():
+    """URL e chave do Supabase (SUPABASE_URL e SUPABASE_KEY no .env)"""
     load_dotenv()
     url = os.getenv("SUPABASE_URL")
     key = os.getenv("SUPABASE_KEY")
     
     if not url or not key:
         raise ValueError("Credenciais do Supabase não encontradas no arquivo .env")
-    return create_client(url, key)
+    return url, key
+
+def init_supabase(url=None, key=None, http_client=None):
+    """Inicializa a conexão com o Supabase"""
+    if url is None or key is None:
+        url, key = supabase_credentials()
+    if http_client is None:
+        return create_client(url, key)
+    return create_client(url, key, options=ClientOptions(httpx_client=http_client))
+
+class SupabaseClientPool:
+    """Clientes Supabase reaproveitados entre threads e sessões.
+
+    Cada cliente tem seu próprio httpx.Client, com conexões keep-alive (e
+    HTTP/2 se o pacote h2 estiver instalado) e timeout por requisição. Os
+    clientes são criados sob demanda até `size`; com todos em uso, `client()`
+    espera um ser devolvido, na ordem de chegada. `stats()` mostra a saturação
+    do pool.
+    """
+
+    def __init__(self, size=SUPABASE_POOL_SIZE, url=None, key=None,
+                 timeout=SUPABASE_REQUEST_TIMEOUT_SECONDS, http2=None):
+        if url is None or key is None:
+            url, key = supabase_credentials()
+        self.url = url
+        self.key = key
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self.http2 = h2 is not None if http2 is None else http2
+        self._lock = threading.Lock()
+        # Pilha: o cliente devolvido por último é o que tem conexões abertas
+        self._idle = []
+        # Fila de espera: cada cliente devolvido vai para quem espera há mais tempo
+        self._waiters = deque()
+        self._http_clients = []
+        self._created = 0
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+
+    def _new_client(self):
+        http_client = httpx.Client(
+            base_url=f"{self.url.rstrip('/')}/rest/v1",
+            headers={"apiKey": self.key, "Authorization": f"Bearer {self.key}"},
+            timeout=httpx.Timeout(self.timeout, connect=SUPABASE_CONNECT_TIMEOUT_SECONDS),
+            limits=httpx.Limits(
+                max_connections=SUPABASE_CONNECTIONS_PER_CLIENT,
+                max_keepalive_connections=SUPABASE_CONNECTIONS_PER_CLIENT,
+                keepalive_expiry=SUPABASE_KEEPALIVE_SECONDS,
+            ),
+            http2=self.http2,
+            follow_redirects=True,
+        )
+        try:
+            client = init_supabase(self.url, self.key, http_client)
+        except Exception:
+            http_client.close()
+            raise
+        with self._lock:
+            self._http_clients.append(http_client)
+        return client
+
+    @contextmanager
+    def client(self):
+        """Empresta um cliente pelo tempo do bloco `with`"""
+        started = time.perf_counter()
+        # slot = [cliente, evento de espera]; cliente None = criar um novo na vaga
+        with self._lock:
+            self._checkouts += 1
+            if self._idle:
+                slot = [self._idle.pop(), None]
+            elif self._created < self.size:
+                # Reserva a vaga; o cliente é criado fora do lock
+                self._created += 1
+                slot = [None, None]
+            else:
+                slot = [None, threading.Event()]
+                self._waiters.append(slot)
+        if slot[1] is not None:
+            slot[1].wait()
+
+        with self._lock:
+            if slot[1] is not None:
+                self._waits += 1
+                self._wait_seconds += time.perf_counter() - started
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+        client = slot[0]
+        try:
+            if client is None:
+                client = self._new_client()
+            yield client
+        finally:
+            self._release(client)
+
+    def _release(self, client):
+        with self._lock:
+            self._in_use -= 1
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter[0] = client
+                waiter[1].set()
+            elif client is None:
+                # A criação falhou: libera a vaga
+                self._created -= 1
+            else:
+                self._idle.append(client)
+
+    def stats(self):
+        """Saturação do pool: clientes em uso, pico, e quantas vezes e por quanto tempo houve espera"""
+        with self._lock:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "peak_in_use": self._peak_in_use,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_seconds": round(self._wait_seconds, 3),
+            }
+
+    def close(self):
+        """Fecha as conexões abertas; o pool não deve mais ser usado"""
+        with self._lock:
+            http_clients, self._http_clients = self._http_clients, []
+            self._idle = []
+        for http_client in http_clients:
+            http_client.close()
+
+def borrow_client(supabase):
+    """Empresta um cliente de um SupabaseClientPool; um cliente avulso é usado direto"""
+    if isinstance(supabase, SupabaseClientPool):
+        return supabase.client()
+    return nullcontext(supabase)
+
+def company_payload(row, job_data=None):
+    """Monta o registro de company da linha, ou None se a linha não tiver company
+
+    Com `job_data`, o id é o do payload já preparado (COMPANY inválido vira None
+    em prepare_jobs_frame em vez de derrubar o lote).
+    """
+    if job_data is not None:
+        company = job_data.get('company')
+    else:
+        company = int(row['COMPANY']) if pd.notna(row['COMPANY']) and row['COMPANY'] != '0' and row['COMPANY'] != '' else None
+    if not company:
+        return None
+    return {
+        "id": company,
+        "company_name": row['COMPANY_NAME'] if pd.notna(row['COMPANY_NAME']) else ''
+    }
+
+def title_payload(row, job_data=None):
+    """Monta o registro de title_taxonomy da linha, ou None se a linha não tiver title
 
-def verify_company(row, supabase_client):
+    Com `job_data`, o id é o do payload já preparado, como em company_payload.
+    """
+    title = job_data.get('title') if job_data is not None else row['TITLE']
+    if not (pd.notna(title) and title != '0' and title != ''):
+        return None
+    return {
+        "id": title,
+        "name": row['TITLE_NAME'] if pd.notna(row['TITLE_NAME']) else '',
+        "latest_version": True
+    }
+
+def verify_company(row, supabase_client, job_data=None):
     """Verifica e cria company se necessário"""
     try:
-        company = int(row['COMPANY']) if pd.notna(row['COMPANY']) and row['COMPANY'] != '0' and row['COMPANY'] != '' else None
-        if company:
-            company_exists = supabase_client.table('company').select('*').eq('id', company).execute()
+        company_data = company_payload(row, job_data)
+        if company_data:
+            company_exists = execute_query(supabase_client.table('company').select('*').eq('id', company_data['id']), 'company', 'select')
             if not company_exists.data:
-                company_data = {
-                    "id": company,
-                    "company_name": row['COMPANY_NAME'] if pd.notna(row['COMPANY_NAME']) else ''
-                }
-                supabase_client.table('company').insert(company_data).execute()
+                execute_query(supabase_client.table('company').insert(company_data, returning=ReturnMethod.minimal), 'company', 'insert', idempotent=False)
     except Exception as e:
         raise Exception(f"Erro ao verificar company: {str(e)}")
 
-def verify_title(row, supabase_client):
+def verify_title(row, supabase_client, job_data=None):
     """Verifica e cria title_taxonomy se necessário"""
     try:
-        title = row['TITLE']
-        if pd.notna(title) and title != '0' and title != '':
-            title_exists = supabase_client.table('title_taxonomy').select('*').eq('id', title).execute()
+        title_data = title_payload(row, job_data)
+        if title_data:
+            title_exists = execute_query(supabase_client.table('title_taxonomy').select('*').eq('id', title_data['id']), 'title_taxonomy', 'select')
             if not title_exists.data:
-                title_data = {
-                    "id": title,
-                    "name": row['TITLE_NAME'] if pd.notna(row['TITLE_NAME']) else '',
-                    "latest_version": True
-                }
-                supabase_client.table('title_taxonomy').insert(title_data).execute()
+                execute_query(supabase_client.table('title_taxonomy').insert(title_data, returning=ReturnMethod.minimal), 'title_taxonomy', 'insert', idempotent=False)
     except Exception as e:
         raise Exception(f"Erro ao verificar title: {str(e)}")
 
-def insert_or_update_job(row, supabase_client):
-    """Insere ou atualiza um job no Supabase"""
+def fetch_existing_jobs(job_ids, supabase_client, columns='id'):
+    """Busca em lote as colunas pedidas dos jobs que já existem, num dict {id: linha}"""
+    existing = {}
+    for chunk in chunked(list(job_ids), IN_FILTER_CHUNK_SIZE):
+        result = execute_query(supabase_client.table('jobs').select(columns).in_('id', chunk), 'jobs', 'select')
+        existing.update((item['id'], item) for item in result.data)
+    return existing
+
+def has_fingerprint_column(supabase_client):
+    """Indica se a tabela jobs tem a coluna import_fingerprint (ver database.md)"""
     try:
-        # Prepara os dados do job
-        job_data = prepare_job_data(row)
-        job_id = job_data['id']
-
-        # Debug
-        print(f"\nProcessando job: {job_id}")
-        
-        # Verifica/cria company primeiro
-        verify_company(row, supabase_client)
-        
-        # Verifica/cria title
-        verify_title(row, supabase_client)
-        
-        # Verifica se o job já existe
-        existing_job = supabase_client.table('jobs').select('id').eq('id', job_id).execute()
-        
-        if existing_job.data:
-            # Atualiza job existente
-            result = supabase_client.table('jobs').update(job_data).eq('id', job_id).execute()
-            print(f"Job atualizado: {job_id}")
-            return 'updated'
-        else:
-            # Insere novo job
-            result = supabase_client.table('jobs').insert(job_data).execute()
-            print(f"Novo job inserido: {job_id}")
-            return 'inserted'
-            
-    except Exception as e:
-        print(f"Erro ao processar job {row.get('ID', 'ID desconhecido')}: {str(e)}")
-        raise
\ No newline at end of file
+        execute_query(supabase_client.table('jobs').select('import_fingerprint').limit(1), 'jobs', 'select')
+    except APIError as e:
+        if e.code in ('42703', 'PGRST204'):
+            return False
+        raise
+    return True
+
+def fetch_existing_job_ids(job_ids, supabase_client):
+    """Retorna o conjunto de ids que já existem na tabela jobs"""
+    return set(fetch_existing_jobs(job_ids, supabase_client))
+
+def upsert_jobs(jobs, supabase_client, existing_ids=None):
+    """Insere ou atualiza um lote de jobs já preparados com poucas chamadas de upsert.
+
+    Retorna uma lista alinhada com `jobs` com tuplas (status, erro), onde status é
+    'inserted', 'updated' ou 'error'. `existing_ids` evita consultar de novo os
+    ids quando quem chama já os buscou.
+    """
+    if existing_ids is None:
+        existing_ids = fetch_existing_job_ids({job['id'] for job in jobs}, supabase_client)
+
+    # A primeira ocorrência de um id novo conta como inserção; as demais como atualização
+    statuses = []
+    seen = set(existing_ids)
+    for job in jobs:
+        statuses.append('updated' if job['id'] in seen else 'inserted')
+        seen.add(job['id'])
+
+    # Só a última versão de cada id é gravada (o Postgres rejeita o mesmo id duas
+    # vezes num upsert) e as linhas são agrupadas pelo conjunto de colunas, para
+    # que campos ausentes não sejam sobrescritos com null
+    latest = {}
+    for position, job in enumerate(jobs):
+        latest[job['id']] = position
+    groups = {}
+    for position in latest.values():
+        groups.setdefault(tuple(sorted(jobs[position])), []).append(position)
+
+    def write(part):
+        execute_query(supabase_client.table('jobs').upsert(
+            [jobs[position] for position in part], on_conflict='id', returning=ReturnMethod.minimal
+        ), 'jobs', 'upsert')
+
+    errors = {}
+    for positions in groups.values():
+        for chunk in chunked(positions, UPSERT_CHUNK_SIZE):
+            # Um job inválido derruba o upsert: o pedaço é dividido até isolar quem falhou
+            _, failures = write_bisecting(chunk, write)
+            errors.update((jobs[position]['id'], error) for position, error in failures.items())
+
+    return [
+        ('error', errors[job['id']]) if job['id'] in errors else (status, None)
+        for job, status in zip(jobs, statuses)
+    ]
+
+def rpc_entry(row, job_data):
+    """Monta a entrada de um job para a função import_jobs_batch (ver import_jobs_batch.sql)"""
+    return {
+        "job": job_data,
+        "company": company_payload(row, job_data),
+        "title": title_payload(row, job_data),
+        "skills": [
+            {"id": skill_id, "name": skill_name}
+            for skill_id, skill_name in named_skills(row, job_data.get('skills', []))
+        ],
+    }
+
+def import_jobs_rpc(entries, supabase_client):
+    """Grava um lote inteiro (referências, jobs e job_skill) com uma chamada à função import_jobs_batch.
+
+    Retorna uma lista alinhada com `entries` com tuplas (status, erro), como upsert_jobs.
+    Como no upsert em lote, só a última ocorrência de cada id é enviada. A
+    função já isola os erros de cada job; se a chamada inteira falhar (por
+    exemplo numa referência inválida), o lote é dividido como em upsert_jobs.
+    """
+    latest = {}
+    for position, entry in enumerate(entries):
+        latest[entry['job']['id']] = position
+
+    def write(part):
+        result = execute_query(
+            supabase_client.rpc('import_jobs_batch', {"payload": [entries[position] for position in part]}),
+            'rpc', 'import_jobs_batch'
+        )
+        return result.data
+
+    successes, failures = write_bisecting(list(latest.values()), write)
+    by_id = {entries[position]['job']['id']: ('error', error) for position, error in failures.items()}
+    for part, items in successes:
+        by_id.update(
+            (entries[part[item['item_position'] - 1]]['job']['id'], (item['status'], item['error_message']))
+            for item in items
+        )
+
+    # A primeira ocorrência de um id novo conta como inserção; as demais como atualização
+    results = []
+    seen = set()
+    for entry in entries:
+        job_id = entry['job']['id']
+        status, error = by_id[job_id]
+        if status == 'inserted' and job_id in seen:
+            status = 'updated'
+        seen.add(job_id)
+        results.append((status, error))
+    return results